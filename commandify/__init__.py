@@ -1,6 +1,9 @@
 from .version import __version__
 from .commandify import CommandifyArgumentParser, CommandifyError
 from .commandify import commandify, command, main_command
+from .commandify import register_command, register_main_command
+from .commandify import register_entry_points, LazyCommand
+from .commandify import CommandRegistry, command_group
 from .commandify import _commands, _main_commands
 
 __all__ = [
@@ -10,6 +13,21 @@ __all__ = [
     'commandify',
     'command',
     'main_command',
+    'register_command',
+    'register_main_command',
+    'register_entry_points',
+    'LazyCommand',
+    'CommandRegistry',
+    'command_group',
+    'scan_commands',
     '_commands',
     '_main_commands'
 ]
+
+
+def scan_commands(*module_names):
+    '''Register the commands in each module by scanning its source, see
+    commandify.scan.scan_commands(...)'''
+    # Imported here as scan imports ast, which is slow to import.
+    from .scan import scan_commands as scan
+    scan(*module_names)
@@ -0,0 +1,109 @@
+'''Running coroutine function (async def) commands
+
+A main command that is a coroutine function is awaited before the sub
+command runs, on the same event loop. In batch mode, command lines can be
+dispatched concurrently on one event loop, see run_batch_concurrently(...).
+'''
+import asyncio
+import traceback
+
+try:
+    from .batch import _exit_status
+    from .commandify import CommandifyError
+except (ImportError, ValueError):
+    # Imported as a top level module, see commandify.commandify.
+    from batch import _exit_status
+    from commandify import CommandifyError
+
+
+def default_loop_factory():
+    '''uvloop's new_event_loop if it is installed, otherwise asyncio's'''
+    try:
+        import uvloop
+    except ImportError:
+        return asyncio.new_event_loop
+    return uvloop.new_event_loop
+
+
+def run(coroutine, loop_factory=None):
+    '''Run coroutine to completion on a new event loop, then close it'''
+    loop = (loop_factory or default_loop_factory())()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        try:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+
+async def dispatch_calls(args, calls):
+    '''Run the (command, command_args) calls for args in order
+
+    As CommandifyArgumentParser.dispatch_commands(), but awaiting commands
+    that return awaitables.'''
+    main_command, main_command_args = calls[0]
+    main_ret = await _maybe_await(main_command(**main_command_args))
+    args.main_ret = main_ret
+    if len(calls) == 2:
+        command, command_args = calls[1]
+        command_ret = await _maybe_await(command(**command_args))
+        return main_ret, command_ret
+    else:
+        return main_ret, None
+
+
+async def _maybe_await(ret):
+    if asyncio.iscoroutine(ret) or isinstance(ret, asyncio.Future):
+        return await ret
+    return ret
+
+
+def run_batch_concurrently(parser, command_lines, concurrency,
+                           loop_factory=None):
+    '''List of (status, ret) for each (line_number, argv) in command_lines
+
+    Each command line is parsed in turn, then dispatched as a task, with at
+    most concurrency tasks running at once. Commands that are not coroutine
+    functions, and command lines chaining sub commands or running required
+    commands, block the event loop while they run.'''
+    return run(_run_batch(parser, command_lines, concurrency),
+               loop_factory or parser.loop_factory)
+
+
+async def _run_batch(parser, command_lines, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_command_line(argv):
+        async with semaphore:
+            # Parse inside the semaphore so that parse errors are reported
+            # in order relative to the output of the commands.
+            try:
+                if isinstance(argv, ValueError):
+                    parser.exit(2, '{0}: error: {1}\n'.format(parser.prog,
+                                                              argv))
+                # Keep hold of args, as parser.args is replaced by the next
+                # command line to be parsed.
+                args = parser.parse_args(argv)
+                try:
+                    calls = parser._dispatch_calls(args)
+                    if parser.chained_args or (
+                            len(calls) == 2 and parser._requirements(args)[1]):
+                        # Run in turn, blocking the event loop, as chained
+                        # and requiring commands cannot be coroutine
+                        # functions.
+                        return 0, parser.dispatch_commands()
+                    return 0, await dispatch_calls(args, calls)
+                except CommandifyError as e:
+                    parser._handle_error(e)
+            except SystemExit as e:
+                return _exit_status(e.code), None
+            except Exception:
+                traceback.print_exc()
+                return 1, None
+
+    tasks = [asyncio.ensure_future(run_command_line(argv))
+             for _, argv in command_lines]
+    return await asyncio.gather(*tasks)
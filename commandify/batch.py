@@ -0,0 +1,163 @@
+'''Running many command lines in one process
+
+Each line of a batch file is a shell quoted command line, without the
+program name, e.g.::
+
+    --main-arg=22 cmd1 --name a1
+    # Comments and blank lines are ignored.
+    cmd3 --arg-with-default='two words'
+
+The parser is built once and every line is parsed and dispatched in turn,
+or, with jobs > 1, by a pool of worker processes forked from the process
+that built the parser.
+'''
+import pickle
+import shlex
+import sys
+import traceback
+from io import StringIO
+
+# The parser used by worker processes, inherited when they are forked.
+_worker_parser = None
+
+
+def read_batch(batch):
+    '''Lines from a filename, '-' for stdin, or an iterable of lines'''
+    if batch == '-':
+        return sys.stdin
+    if isinstance(batch, str):
+        with open(batch) as f:
+            return f.readlines()
+    return batch
+
+
+def parse_batch(lines):
+    '''Split lines into (line_number, argv), skipping blanks and comments
+
+    Lines that cannot be split have argv set to the ValueError.'''
+    for line_number, line in enumerate(lines, 1):
+        try:
+            argv = shlex.split(line, comments=True)
+        except ValueError as e:
+            yield line_number, e
+            continue
+        if argv:
+            yield line_number, argv
+
+
+def run_batch(parser, lines, jobs=1, concurrency=1):
+    '''Parse and dispatch each command line using parser
+
+    parser must already have had setup_arguments() called. Returns a list of
+    (line_number, exit_status, (main_ret, command_ret)) tuples; failing
+    lines are reported on stderr and have None for their return values.
+
+    With jobs > 1 the command lines are run in that many worker processes.
+    Each command line's output is captured and written out in order, and
+    return values must be picklable.
+
+    Otherwise, with concurrency > 1, up to that many coroutine function
+    (async def) commands are run concurrently on one event loop, see
+    commandify.aio.'''
+    command_lines = list(parse_batch(lines))
+    if jobs > 1:
+        outcomes = _run_in_pool(parser, command_lines, jobs)
+    elif concurrency > 1:
+        try:
+            from .aio import run_batch_concurrently
+        except (ImportError, ValueError):
+            # Imported as a top level module, see commandify.commandify.
+            from aio import run_batch_concurrently
+        outcomes = run_batch_concurrently(parser, command_lines, concurrency)
+    else:
+        outcomes = (_run_parsed_line(parser, argv)
+                    for _, argv in command_lines)
+
+    results = []
+    for (line_number, _), (status, ret) in zip(command_lines, outcomes):
+        if status != 0:
+            sys.stderr.write('{0}: line {1}: exit status {2}\n'
+                             .format(parser.prog, line_number, status))
+        results.append((line_number, status, ret))
+    return results
+
+
+def _run_parsed_line(parser, argv):
+    if isinstance(argv, ValueError):
+        sys.stderr.write('{0}: error: {1}\n'.format(parser.prog, argv))
+        return 2, None
+    return run_command_line(parser, argv)
+
+
+def _run_in_pool(parser, command_lines, jobs):
+    '''Yield (status, ret) for each command line, run in worker processes'''
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        # Workers could not inherit the parser and commands.
+        sys.stderr.write('{0}: warning: cannot fork, running batch in one '
+                         'process\n'.format(parser.prog))
+        for _, argv in command_lines:
+            yield _run_parsed_line(parser, argv)
+        return
+
+    global _worker_parser
+    _worker_parser = parser
+    argvs = [argv for _, argv in command_lines]
+    chunksize = max(1, len(argvs) // (jobs * 4))
+    executor = ProcessPoolExecutor(
+        jobs, mp_context=multiprocessing.get_context('fork'))
+    try:
+        outcomes = executor.map(_run_captured, argvs, chunksize=chunksize)
+        for status, ret, stdout, stderr in outcomes:
+            sys.stdout.write(stdout)
+            sys.stderr.write(stderr)
+            yield status, ret
+    finally:
+        executor.shutdown()
+        _worker_parser = None
+
+
+def _run_captured(argv):
+    '''Run a command line in a worker, capturing its output'''
+    old_stdout, old_stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = StringIO(), StringIO()
+    try:
+        status, ret = _run_parsed_line(_worker_parser, argv)
+        try:
+            pickle.dumps(ret)
+        except Exception as e:
+            sys.stderr.write('{0}: error: cannot return {1!r} from worker: '
+                             '{2}\n'.format(_worker_parser.prog, ret, e))
+            status, ret = 1, None
+        return status, ret, sys.stdout.getvalue(), sys.stderr.getvalue()
+    finally:
+        sys.stdout, sys.stderr = old_stdout, old_stderr
+
+
+def run_command_line(parser, argv):
+    '''Parse and dispatch a single command line, returning (status, ret)
+
+    Errors that would normally exit the process, and exceptions raised by
+    the commands, are turned into a non-zero exit status.'''
+    # Make sure nothing from a previous command line is dispatched.
+    parser.args = None
+    try:
+        parser.parse_args(argv)
+        return 0, parser.dispatch_commands()
+    except SystemExit as e:
+        return _exit_status(e.code), None
+    except Exception:
+        traceback.print_exc()
+        return 1, None
+
+
+def _exit_status(code):
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    # sys.exit('message') prints the message and exits with status 1.
+    sys.stderr.write('{0}\n'.format(code))
+    return 1
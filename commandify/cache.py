@@ -0,0 +1,129 @@
+'''On-disk caching of data derived from the registered commands
+
+Cached data is stored along with a key derived from the commands' code
+objects and decorator arguments, so that any change to a command invalidates
+the cache.'''
+import hashlib
+import marshal
+import os
+import pickle
+
+try:
+    from .version import VERSION
+except (ImportError, ValueError):
+    # Imported as a top level module, see commandify.commandify.
+    from version import VERSION
+
+# Key for the completion index, which cannot be keyed on the commands as it
+# is used without importing them. Its staleness is checked using the
+# modification times of the commands' source files.
+COMPLETION_INDEX_KEY = 'completion-index-1'
+
+# Part of registry keys, so that specs and help cached by commandify
+# versions that derive them differently are not used. Bump when the format
+# of specs changes.
+SPEC_KEY_VERSION = 'spec-3'
+
+
+def cache_path(cache_dir, prog, kind):
+    '''Path of the cache of a given kind for the program prog'''
+    return os.path.join(cache_dir, '{0}.{1}'.format(prog, kind))
+
+
+def registry_key(containers, *extra):
+    '''Hash the commands in containers, plus any extra settings
+
+    Each container maps names to (func, dec_args, dec_kwargs) tuples, as
+    _main_commands and _commands do. The key also depends on the spec format
+    and commandify versions.'''
+    sha = hashlib.sha1()
+    sha.update(repr((SPEC_KEY_VERSION, VERSION)).encode('utf-8'))
+    for container in containers:
+        for name, (func, dec_args, dec_kwargs) in container.items():
+            sha.update(name.encode('utf-8'))
+            sha.update(function_fingerprint(func))
+            sha.update(stable_repr((dec_args, dec_kwargs)).encode('utf-8'))
+    sha.update(stable_repr(extra).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def stable_repr(value):
+    '''repr(value), but the same in every process
+
+    Functions, classes and objects without a repr of their own, e.g. an
+    argument's type, are described by name (and functions also by their
+    fingerprint), rather than by their memory address. Dicts are sorted.'''
+    if isinstance(value, dict):
+        return '{{{0}}}'.format(', '.join(sorted(
+            '{0}: {1}'.format(stable_repr(key), stable_repr(item))
+            for key, item in value.items())))
+    if isinstance(value, (list, tuple)):
+        return '{0}[{1}]'.format(type(value).__name__, ', '.join(
+            stable_repr(item) for item in value))
+    name = getattr(value, '__qualname__', None)
+    if getattr(value, '__module__', None) is not None:
+        name = '{0}.{1}'.format(value.__module__, name)
+    if hasattr(value, '__code__'):
+        return '{0}:{1}'.format(name, hashlib.sha1(
+            function_fingerprint(value)).hexdigest())
+    if isinstance(value, type) or (callable(value) and
+                                   hasattr(value, '__qualname__')):
+        # Classes, and builtin functions and methods.
+        return name
+    if type(value).__repr__ is object.__repr__:
+        return '{0}({1})'.format(stable_repr(type(value)),
+                                 stable_repr(getattr(value, '__dict__', {})))
+    return repr(value)
+
+
+def function_fingerprint(func):
+    '''Bytes identifying a function's bytecode, default values and
+    annotations
+
+    Objects standing in for functions, such as commandify.LazyCommand, can
+    provide their own via a commandify_fingerprint() method.'''
+    fingerprint = getattr(func, 'commandify_fingerprint', None)
+    if fingerprint is not None:
+        return fingerprint()
+    return (marshal.dumps(func.__code__) +
+            repr((func.__defaults__,
+                  getattr(func, '__annotations__', None))).encode('utf-8'))
+
+
+def load_cache(path, key):
+    '''Load data cached at path, or None if missing or stale'''
+    try:
+        with open(path, 'rb') as f:
+            cached_key, data = pickle.load(f)
+    except Exception:
+        # A missing, corrupt or unloadable cache is just a cache miss.
+        return None
+    if cached_key != key:
+        return None
+    return data
+
+
+def save_cache(path, key, data):
+    '''Atomically save data to path, returning False if it cannot be saved
+
+    Data that cannot be pickled (e.g. a lambda used as a type) is not
+    cached.'''
+    # Imported here as it is slow to import, and rarely needed.
+    import tempfile
+    dirname = os.path.dirname(path) or '.'
+    try:
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        fd, tmp_path = tempfile.mkstemp(dir=dirname)
+    except (IOError, OSError):
+        return False
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((key, data), f, 2)
+        os.rename(tmp_path, path)
+    except (IOError, OSError, pickle.PicklingError, TypeError,
+            AttributeError):
+        os.remove(tmp_path)
+        return False
+    return True
@@ -1,11 +1,40 @@
 '''Decorators/functions for turning functions into command line arguments'''
+import importlib
+import os
+import sys
+import time
+import weakref
 from collections import OrderedDict
-from argparse import ArgumentParser
+from argparse import ArgumentParser, Namespace
 from functools import wraps
 
 
-_commands = OrderedDict()
-_main_commands = OrderedDict()
+# _CommandPlan for each command function, see _command_plan(...).
+_command_plans = weakref.WeakKeyDictionary()
+
+# Options for each command function as a whole, e.g. cache, see
+# _store_command_options(...).
+_command_options = weakref.WeakKeyDictionary()
+
+# Commands with a requires option, so that dispatch_commands() only looks
+# for required commands if there are any.
+_requiring_commands = weakref.WeakSet()
+
+# Decorator options for a command as a whole, rather than for an argument.
+_COMMAND_OPTIONS = ['cache', 'map_reduce', 'requires']
+
+# When commandify was imported, to time the import of the command modules.
+_import_time = time.perf_counter()
+
+
+def _submodule(name):
+    '''The commandify submodule name, imported when first needed
+
+    Also works when commandify is imported as a top level module, e.g. by
+    commandify_examples when run from within the package directory.'''
+    if __package__:
+        return importlib.import_module('.' + name, __package__)
+    return importlib.import_module(name)
 
 
 def main_command(*dec_args, **dec_kwargs):
@@ -16,7 +45,9 @@ def main_command(*dec_args, **dec_kwargs):
 
 
 def command(*dec_args, **dec_kwargs):
-    '''Decorator for adding to sub commands'''
+    '''Decorator for adding to sub commands
+
+    cache=True caches the command's results on disk, see commandify.memo.'''
     return _store_command(dec_args, dec_kwargs, _commands)
 
 
@@ -24,6 +55,7 @@ def _store_command(dec_args, dec_kwargs, command_container):
     if len(dec_args) == 1 and callable(dec_args[0]):
         func = dec_args[0]
         command_container[func.__name__] = (func, [], {})
+        _command_plan(func)
 
         # Preserve e.g. docstring.
         @wraps(func)
@@ -33,15 +65,424 @@ def _store_command(dec_args, dec_kwargs, command_container):
     else:
 
         def decorator(func):
-            command_container[func.__name__] = (func, dec_args, dec_kwargs)
+            command_container[func.__name__] = (
+                func, dec_args, _store_command_options(func, dec_kwargs))
+            _command_plan(func)
 
             # Preserve e.g. docstring.
             @wraps(func)
             def decorator_wrapper(*func_args, **func_kwargs):
                 return func(*func_args, **func_kwargs)
+            return decorator_wrapper
         return decorator
 
 
+def command_group(name, registry=None, help=None):
+    '''Add a group of sub commands, run as e.g. tool name command ...
+
+    See CommandRegistry.group(...).'''
+    return _default_registry.group(name, registry, help)
+
+
+def register_command(target, name=None, help=None, **dec_kwargs):
+    '''Register a sub command by dotted path, e.g. "pkg.module:func"
+
+    The module is only imported when the command is needed. dec_kwargs are
+    as for @command(...), and giving help avoids importing the module to
+    show the main --help. Best used with commandify(lazy=True).'''
+    _store_lazy_command(target, name, help, dec_kwargs, _commands)
+
+
+def register_main_command(target, name=None, help=None, **dec_kwargs):
+    '''Register the main command by dotted path, e.g. "pkg.module:func"'''
+    _store_lazy_command(target, name, help, dec_kwargs, _main_commands)
+
+
+def register_entry_points(group):
+    '''Register a sub command for each setuptools entry point in group
+
+    Entry points are of the form name = pkg.module:func.'''
+    _default_registry.register_entry_points(group)
+
+
+def _store_lazy_command(target, name, help, dec_kwargs, command_container):
+    lazy_command = LazyCommand(target, doc=help)
+    name = name or lazy_command.__name__
+    command_container[name] = (
+        lazy_command, (), _store_command_options(lazy_command, dec_kwargs))
+
+
+def _store_command_options(func, dec_kwargs):
+    '''dec_kwargs without options for the command as a whole, which are
+    stored for func
+
+    Options for arguments are dicts, so e.g. a cache option that is not a
+    dict is for caching the command's results, see commandify.memo, and a
+    map_reduce option is for running it over chunks of a file, see
+    commandify.mapreduce.'''
+    options = dict((key, dec_kwargs[key]) for key in _COMMAND_OPTIONS
+                   if key in dec_kwargs and
+                   not isinstance(dec_kwargs[key], dict))
+    if not options:
+        return dec_kwargs
+    _command_options[func] = options
+    if options.get('requires'):
+        _requiring_commands.add(func)
+    return dict((key, value) for key, value in dec_kwargs.items()
+                if key not in options)
+
+
+def _iter_entry_points(group):
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        import pkg_resources
+        for entry_point in pkg_resources.iter_entry_points(group):
+            yield entry_point.name, '{0}:{1}'.format(
+                entry_point.module_name, '.'.join(entry_point.attrs))
+        return
+
+    entry_points = entry_points()
+    if hasattr(entry_points, 'select'):
+        group_entry_points = entry_points.select(group=group)
+    else:
+        group_entry_points = entry_points.get(group, [])
+    for entry_point in group_entry_points:
+        # Strip any extras, e.g. 'pkg.module:func [extra]'.
+        yield entry_point.name, entry_point.value.split('[')[0].strip()
+
+
+class CommandRegistry(object):
+    '''A main command and sub commands, registered using its methods
+
+    The module level decorators and functions, e.g. @command, register
+    commands in a default registry. A separate registry can be given to
+    CommandifyArgumentParser(registry=...), and can be used to build any
+    number of parsers.
+
+    Groups of sub commands, each in their own registry, can be added using
+    group(...).'''
+    def __init__(self):
+        self.main_commands = OrderedDict()
+        self.commands = OrderedDict()
+        self.groups = OrderedDict()
+
+    def main_command(self, *dec_args, **dec_kwargs):
+        '''As @main_command, registering in this registry'''
+        return _store_command(dec_args, dec_kwargs, self.main_commands)
+
+    def command(self, *dec_args, **dec_kwargs):
+        '''As @command, registering in this registry'''
+        return _store_command(dec_args, dec_kwargs, self.commands)
+
+    def register_command(self, target, name=None, help=None, **dec_kwargs):
+        '''As register_command(...), registering in this registry'''
+        _store_lazy_command(target, name, help, dec_kwargs, self.commands)
+
+    def register_main_command(self, target, name=None, help=None,
+                              **dec_kwargs):
+        '''As register_main_command(...), registering in this registry'''
+        _store_lazy_command(target, name, help, dec_kwargs,
+                            self.main_commands)
+
+    def group(self, name, registry=None, help=None):
+        '''Add a group of sub commands, run as e.g. tool name command ...
+
+        registry holds the group's sub commands (and any nested groups). It
+        can be a "pkg.module:attr" path to a CommandRegistry, which is only
+        imported when the group is used, in which case giving help avoids
+        importing it to show the main --help. Returns registry, or a new
+        CommandRegistry if it is not given.'''
+        if registry is None:
+            registry = CommandRegistry()
+        self.groups[name] = _CommandGroup(registry, help)
+        return registry
+
+    def register_entry_points(self, group):
+        '''As register_entry_points(...), registering in this registry'''
+        for name, target in _iter_entry_points(group):
+            self.register_command(target, name=name)
+
+    def parser(self, *args, **kwargs):
+        '''A CommandifyArgumentParser for these commands, ready to parse
+
+        Takes the same arguments as CommandifyArgumentParser.'''
+        kwargs['registry'] = self
+        parser = CommandifyArgumentParser(*args, **kwargs)
+        parser.setup_arguments()
+        return parser
+
+
+class _CommandGroup(object):
+    '''A group of sub commands, registered by CommandRegistry.group(...)
+
+    Stands in for the group's registry, which is imported on first use if
+    given as a "pkg.module:attr" path.'''
+    def __init__(self, target, help=None):
+        self.target = target
+        self.help = help
+        self._registry = None if isinstance(target, str) else target
+
+    def resolve(self):
+        if self._registry is None:
+            if ':' not in self.target:
+                raise CommandifyError('Command group {0} not of the form '
+                                      'pkg.module:attr'.format(self.target))
+            module_name, attrs = self.target.split(':')
+            registry = importlib.import_module(module_name)
+            for attr in attrs.split('.'):
+                registry = getattr(registry, attr)
+            if not isinstance(registry, CommandRegistry):
+                raise CommandifyError('Command group {0} is not a '
+                                      'CommandRegistry'.format(self.target))
+            self._registry = registry
+        return self._registry
+
+    @property
+    def main_commands(self):
+        return self.resolve().main_commands
+
+    @property
+    def commands(self):
+        return self.resolve().commands
+
+    @property
+    def groups(self):
+        return self.resolve().groups
+
+
+# Registry used by the module level decorators and functions.
+_default_registry = CommandRegistry()
+_main_commands = _default_registry.main_commands
+_commands = _default_registry.commands
+
+
+class LazyCommand(object):
+    '''Stands in for a command function, importing it on first use
+
+    Attribute access (e.g. __code__) and calls are forwarded to the
+    function. If doc and signature (argument names and defaults) are known,
+    e.g. from scanning the module's source, they are used without importing
+    the module.'''
+    def __init__(self, target, doc=None, signature=None):
+        if ':' not in target:
+            raise CommandifyError('Command target {0} not of the form '
+                                  'pkg.module:func'.format(target))
+        self.target = target
+        self.module_name, self.func_name = target.split(':')
+        self.__name__ = self.func_name.split('.')[-1]
+        self._doc = doc
+        self._signature = signature
+        self._func = None
+        self.import_seconds = None
+
+    def _command_doc(self):
+        '''The function's docstring, as given if it is not imported yet'''
+        if self._func is None and self._doc is not None:
+            return self._doc
+        return self.resolve().__doc__
+
+    @property
+    def static(self):
+        '''True if the command can be described without importing it'''
+        return self._doc is not None and self._signature is not None
+
+    def signature(self):
+        '''Argument names and defaults, as from the function's signature'''
+        if self._signature is not None:
+            return self._signature
+        return _command_signature(self.resolve())
+
+    def resolve(self):
+        '''Import and return the real function'''
+        if self._func is None:
+            start = time.perf_counter()
+            func = importlib.import_module(self.module_name)
+            for attr in self.func_name.split('.'):
+                func = getattr(func, attr)
+            # Use the undecorated function if it was decorated by @command.
+            self._func = getattr(func, '__wrapped__', func)
+            self.import_seconds = time.perf_counter() - start
+        return self._func
+
+    def commandify_fingerprint(self):
+        '''Bytes identifying the command without importing its module
+
+        Uses the module's source, which determines the function's bytecode.
+        '''
+        from importlib.util import find_spec
+        parts = [self.target.encode('utf-8')]
+        module_spec = find_spec(self.module_name)
+        if module_spec is not None and module_spec.has_location:
+            with open(module_spec.origin, 'rb') as f:
+                parts.append(f.read())
+        if self._doc is not None:
+            parts.append(self._doc.encode('utf-8'))
+        return b'\0'.join(parts)
+
+    def __getattr__(self, name):
+        if name.startswith('_') and not name.startswith('__'):
+            # Not yet initialised, e.g. while being copied.
+            raise AttributeError(name)
+        return getattr(self.resolve(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __repr__(self):
+        return '<LazyCommand {0}>'.format(self.target)
+
+
+class _CommandDoc(object):
+    '''A class's __doc__, giving the command's docstring for instances,
+    e.g. of LazyCommand, so that the class keeps its own docstring'''
+    def __init__(self, class_doc):
+        self.class_doc = class_doc
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self.class_doc
+        return instance._command_doc()
+
+
+LazyCommand.__doc__ = _CommandDoc(LazyCommand.__doc__)
+
+
+def _registered_command(command_container, name):
+    '''The (command, dec_args, dec_kwargs) registered under name
+
+    LazyCommands that cannot be described without importing them are
+    imported first, as their module may register them with its own
+    decorator options.'''
+    command = command_container[name][0]
+    if isinstance(command, LazyCommand) and not command.static:
+        command.resolve()
+    return command_container[name]
+
+
+def _is_coroutine_function(command):
+    '''True if command was defined with async def
+
+    Checks the code flags directly, as inspect is slow to import.'''
+    if isinstance(command, LazyCommand):
+        command = command.resolve()
+    code = getattr(command, '__code__', None)
+    return code is not None and bool(code.co_flags & _CO_COROUTINE)
+
+
+def _command_source(command):
+    '''Path of the source file that defines a command function'''
+    if isinstance(command, LazyCommand):
+        from importlib.util import find_spec
+        module_spec = find_spec(command.module_name)
+        if module_spec is None or not module_spec.has_location:
+            return None
+        return module_spec.origin
+    return os.path.abspath(command.__code__.co_filename)
+
+
+def _command_signature(command):
+    '''Argument names and defaults of a command function
+
+    Equivalent to using __code__ and __defaults__, but does not import
+    LazyCommands that know their signature.'''
+    if isinstance(command, LazyCommand):
+        return command.signature()
+    code = command.__code__
+    return code.co_varnames[:code.co_argcount], command.__defaults__
+
+
+class _CommandPlan(object):
+    '''A command's signature, worked out once for parsers to use
+
+    defaults has _NoDefaultClass for arguments without a default.'''
+    __slots__ = ('argument_names', 'option_names', 'defaults')
+
+    def __init__(self, command):
+        argument_names, command_defaults = _command_signature(command)
+        self.argument_names = tuple(argument_names)
+        self.option_names = tuple('--' + varname.replace('_', '-')
+                                  for varname in argument_names)
+        command_defaults = tuple(command_defaults or ())
+        self.defaults = ((_NoDefaultClass,) *
+                         (len(argument_names) - len(command_defaults)) +
+                         command_defaults)
+
+
+class _CommandBinding(object):
+    '''Where each of a command's arguments comes from, for one parser
+
+    args_names take the parsed args, provided maps names to values from
+    provide_args and parsed_names are taken from the parsed args. options
+    are those for the command as a whole, see _store_command_options(...).
+    '''
+    __slots__ = ('args_names', 'provided', 'parsed_names', 'options')
+
+    def __init__(self, plan, provide_args, options):
+        self.args_names = tuple(varname for varname in plan.argument_names
+                                if varname == 'args')
+        self.provided = dict((varname, provide_args[varname])
+                             for varname in plan.argument_names
+                             if varname != 'args' and varname in provide_args)
+        self.parsed_names = tuple(varname for varname in plan.argument_names
+                                  if varname != 'args' and
+                                  varname not in provide_args)
+        self.options = options
+
+
+def _command_plan(command):
+    '''The _CommandPlan for command, made when it is first needed
+
+    Made when functions are decorated, and when LazyCommands are first
+    described, which imports them unless their signature is known.'''
+    plan = _command_plans.get(command)
+    if plan is None:
+        plan = _command_plans[command] = _CommandPlan(command)
+    return plan
+
+
+class _CachedCommand(object):
+    '''Stands in for a command, only calling it if its result for the
+    arguments it is called with is not in result_cache'''
+    __slots__ = ('name', 'command', 'result_cache', 'timed')
+
+    def __init__(self, name, command, result_cache, timed):
+        self.name = name
+        self.command = command
+        self.result_cache = result_cache
+        self.timed = timed
+
+    def commandify_fingerprint(self):
+        return _submodule('cache').function_fingerprint(self.command)
+
+    def __call__(self, **command_args):
+        with self.timed('result_cache_get', self.name):
+            key = self.result_cache.key(self.command, command_args)
+            if key is None:
+                hit = False
+            else:
+                hit, result = self.result_cache.get(key)
+        if hit:
+            return result
+        result = self.command(**command_args)
+        if key is not None:
+            with self.timed('result_cache_put', self.name):
+                self.result_cache.put(key, result)
+        return result
+
+
+class _NullTimer(object):
+    '''Stands in for commandify.timing's timers when not timing'''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
 class _NoDefaultClass(object):
     '''private class used to indicate that there is no default
 
@@ -49,6 +490,13 @@ class _NoDefaultClass(object):
     pass
 
 
+# Returned by _peek_command when argv asks for the main command's help.
+_HELP_REQUESTED = object()
+
+# Code flag set for functions defined with async def, see inspect.
+_CO_COROUTINE = 0x80
+
+
 class CommandifyError(Exception):
     '''Exceptions thrown by commandify'''
     def __init__(self, message, error_type='code'):
@@ -59,13 +507,101 @@ class CommandifyError(Exception):
 
 
 class CommandifyArgumentParser(ArgumentParser):
+    '''ArgumentParser that builds its arguments from decorated functions
+
+    If lazy is True, only the subparser for the subcommand named in argv is
+    built; all subparsers are built for help, errors and argcomplete.
+
+    If cache_dir is given, the argument specs derived from the commands are
+    cached there and reused until any command changes.
+
+    Commands can be coroutine functions (async def), which are run on an
+    event loop created by loop_factory; by default uvloop's if it is
+    installed, otherwise asyncio's.
+
+    If timings is a commandify.timing.Timings, the time taken by each phase,
+    e.g. setting up arguments for each command, is recorded in it.
+
+    If profile_dir is given, the dispatched commands are profiled by
+    profiler ('sample' or 'cprofile'), with a profile for each command
+    written there, see commandify.profiling.
+
+    Commands are taken from registry, by default that used by @command etc.
+    Once set up, the parser can parse and dispatch any number of command
+    lines.
+
+    If fast_parse is True, simple command lines are parsed without using
+    argparse, see commandify.fastparse.
+
+    Command groups are added as subparsers with their own subparsers, only
+    when the group is named in the command line (or help, errors or
+    argcomplete need all subparsers). The sub command of a group is stored
+    in args.GROUP_command, e.g. args.data_command for tool data import.
+
+    Commands decorated with cache=True store their results in result_cache,
+    a commandify.memo.ResultCache in cache_dir made when first needed.
+
+    If chain is True, sub commands can be chained, e.g.
+    tool cmd_a --x 1 + cmd_b, in which case each is given the previous
+    one's return value as args.prev_ret. Only a + followed by a sub command
+    or command group name chains, and a + argument value followed by one
+    can be given as e.g. --x=+.
+
+    Sub commands decorated with requires=[...] are run after the commands
+    they require, which are run concurrently by dag_jobs threads (or
+    processes if dag_executor is 'process'), see commandify.dag.'''
     def __init__(self, provide_args={}, guess_type=True,
-                 suppress_warnings=[], *args, **kwargs):
+                 suppress_warnings=[], lazy=False, cache_dir=None,
+                 loop_factory=None, timings=None, profile_dir=None,
+                 profiler='sample', registry=None, fast_parse=False,
+                 dag_jobs=None, dag_executor='thread', chain=False, *args,
+                 **kwargs):
         super(CommandifyArgumentParser, self).__init__(*args, **kwargs)
         self.provide_args = provide_args
         self.guess_type = guess_type
         self.suppress_warnings = suppress_warnings
+        self.lazy = lazy
+        self.cache_dir = cache_dir
+        self.loop_factory = loop_factory
+        self.timings = timings
+        self.profile_dir = profile_dir
+        self.profiler = profiler
+        self.registry = _default_registry if registry is None else registry
+        self.fast_parse = fast_parse
+        self.dag_jobs = dag_jobs
+        self.dag_executor = dag_executor
+        self.chain = chain
+        self._fast_options = {}
+        self._cache_path = None
+        # The parser that added this one as a subparser, and its name.
+        self._help_parent = None
+        self._help_name = None
         self.replaced_bool_args = []
+        self._subparsers = None
+        self._built_commands = set()
+        self._bindings = {}
+        self.chained_args = []
+        self.result_cache = None
+        # Where the sub command is stored in args, and whether this parser
+        # is for a command group (which has no main command).
+        self._command_dest = 'command'
+        self._is_group = False
+
+    @property
+    def _main_commands(self):
+        return self.registry.main_commands
+
+    @property
+    def _commands(self):
+        return self.registry.commands
+
+    @property
+    def _groups(self):
+        return self.registry.groups
+
+    def _subcommand_names(self):
+        '''Names of the sub commands, then the command groups'''
+        return list(self._commands) + list(self._groups)
 
     def _warn(self, kind, message):
         if kind not in self.suppress_warnings:
@@ -73,57 +609,380 @@ class CommandifyArgumentParser(ArgumentParser):
             print('...Disable warning by passing suppress_warnings=["{0}"]'
                   .format(kind))
 
+    def _timed(self, phase, command=None):
+        '''Context manager that records the time taken by phase'''
+        if self.timings is None:
+            return _NULL_TIMER
+        return self.timings.time(phase, command)
+
     def setup_arguments(self):
+        with self._timed('setup_arguments'):
+            self._setup_arguments()
+
+    def _setup_arguments(self):
         try:
-            if len(_main_commands) == 0:
+            if self._is_group:
+                if len(self._main_commands):
+                    raise CommandifyError('Command group {0} has a '
+                                          'main_command'.format(self.prog))
+            elif len(self._main_commands) == 0:
                 raise CommandifyError('No main_command defined\n'
                                       'Please add the @main_command decorator '
                                       'to one function')
-            elif len(_main_commands) > 1:
+            elif len(self._main_commands) > 1:
                 raise CommandifyError('More than one main_command defined\n'
                                       'Please add the @main_command decorator '
                                       'to only one function')
 
+            for name in self._groups:
+                if name in self._commands:
+                    raise CommandifyError('{0} is both a command and a '
+                                          'command group'.format(name))
+
             # Setup main command.
-            main_command, main_args, main_kwargs =\
-                list(_main_commands.values())[0]
-            main_doc = main_command.__doc__
-            description = main_doc.split('\n')[0] if main_doc else None
-            self._add_commands_to_parser(main_command, self,
-                                         main_args, main_kwargs)
-
-            if len(_commands):
-                # Setup subcommands.
-                subparsers = self.add_subparsers(dest='command')
-                for name, (command, dec_args, dec_kwargs) in _commands.items():
-                    if command.__doc__:
-                        help = command.__doc__.split('\n')[0]
-                    else:
-                        help = None
-                    subparser = subparsers.add_parser(name, help=help)
-                    self._add_commands_to_parser(command, subparser,
-                                                 dec_args, dec_kwargs)
+            self._load_specs()
+            if not self._is_group:
+                with self._timed('add_arguments',
+                                 list(self._main_commands)[0]):
+                    self._add_spec_to_parser(self._main_spec, self)
+
+            if len(self._commands) or len(self._groups):
+                # Setup subcommands. In lazy mode these are built on demand
+                # by parse_args(), unless argcomplete needs all of them.
+                # Command groups are always built on demand.
+                self._subparsers = self.add_subparsers(
+                    dest=self._command_dest)
+                if '_ARGCOMPLETE' in os.environ:
+                    self._build_all_subparsers()
+                elif not self.lazy:
+                    self._build_all_subparsers(groups=False)
 
         except CommandifyError as e:
-            if e.error_type == 'user':
-                self.print_help()
-            self.exit(status=1,
-                      message='{0}: error: {1}\n'.format(self.prog, e))
-
-    def _add_commands_to_parser(self, command, parser, dec_args, dec_kwargs):
-        # Work out defaults for each command, set all defaults to
-        # _NoDefaultClass then loop over default args (as defined in function
-        # signature) settings them as necessary.
-        defaults = [_NoDefaultClass] * command.__code__.co_argcount
-        if command.__defaults__:
-            for i in range(1, len(command.__defaults__) + 1):
-                defaults[-i] = command.__defaults__[-i]
-
-        # Loop over varnames (function argument names *and* local vars)
-        # and defaults, adding an argparse argument.
-        command_argument_names =\
-            command.__code__.co_varnames[:command.__code__.co_argcount]
-        for varname, default in zip(command_argument_names, defaults):
+            self._handle_error(e)
+
+    def _handle_error(self, e):
+        if e.error_type == 'user':
+            self.print_help()
+        self.exit(status=1,
+                  message='{0}: error: {1}\n'.format(self.prog, e))
+
+    def _load_specs(self):
+        '''Derive argument specs for the commands, or load them from cache
+
+        Specs for lazily imported commands are only derived when needed, and
+        the cache is only saved once all specs are known.'''
+        self._cache_path = None
+        if self.cache_dir is not None:
+            cache = _submodule('cache')
+            self._cache_path = cache.cache_path(self.cache_dir, self.prog,
+                                                'spec')
+            self._cache_key = cache.registry_key(
+                [self._main_commands, self._commands], self.guess_type,
+                sorted(self.provide_args),
+                [(name, group.help) for name, group in self._groups.items()])
+            with self._timed('load_spec_cache'):
+                specs = cache.load_cache(self._cache_path, self._cache_key)
+            if specs is not None:
+                self._main_spec, self._command_specs = specs
+                return
+
+        if self._is_group:
+            self._main_spec = {'arguments': [], 'replaced_bool_args': [],
+                               'warnings': [], 'inputs': [], 'outputs': []}
+        else:
+            main_name = list(self._main_commands)[0]
+            with self._timed('command_spec', main_name):
+                self._main_spec = self._command_spec(
+                    *_registered_command(self._main_commands, main_name))
+        self._command_specs = OrderedDict()
+        for name, (command, dec_args, dec_kwargs) in self._commands.items():
+            if not isinstance(command, LazyCommand) or command.static:
+                self._get_spec(name)
+
+    def _get_spec(self, name):
+        if name not in self._command_specs:
+            with self._timed('command_spec', name):
+                self._command_specs[name] = self._command_spec(
+                    *_registered_command(self._commands, name))
+            if (self._cache_path is not None and
+                    len(self._command_specs) == len(self._commands)):
+                command_specs = OrderedDict((name, self._command_specs[name])
+                                            for name in self._commands)
+                _submodule('cache').save_cache(
+                    self._cache_path, self._cache_key,
+                    (self._main_spec, command_specs))
+        return self._command_specs[name]
+
+    def _command_help(self, name):
+        if name in self._groups:
+            return self._groups[name].help
+        doc = self._commands[name][0].__doc__
+        return doc.split('\n')[0] if doc else None
+
+    def _add_command_help(self):
+        '''Set the help shown for each sub command from its docstring
+
+        Deferred until help is formatted, as docstrings may need LazyCommands
+        to be imported.'''
+        if self._subparsers is None:
+            return
+        for action in self._subparsers._choices_actions:
+            if action.help is None:
+                action.help = self._command_help(action.dest)
+
+    def _add_subparser(self, name):
+        if name not in self._subparsers.choices:
+            kwargs = {}
+            if name in self._groups:
+                # The registry is not used (so not imported) until the
+                # group's parser is set up.
+                kwargs = dict(registry=self._groups[name],
+                              provide_args=self.provide_args,
+                              guess_type=self.guess_type,
+                              suppress_warnings=self.suppress_warnings,
+                              lazy=self.lazy, timings=self.timings)
+            # Passing help lists the command in the main help, see
+            # _add_command_help().
+            subparser = self._subparsers.add_parser(name, help=None,
+                                                    **kwargs)
+            subparser._help_parent = self
+            subparser._help_name = name
+            if name in self._groups:
+                subparser._is_group = True
+                subparser._command_dest = '{0}{1}_command'.format(
+                    self._command_dest[:-len('command')],
+                    name.replace('-', '_'))
+                # So that parse_args() replaces the group's bool args.
+                subparser.replaced_bool_args = self.replaced_bool_args
+        return self._subparsers.choices[name]
+
+    def _build_subparser(self, name):
+        with self._timed('build_subparser', name):
+            subparser = self._add_subparser(name)
+            self._built_commands.add(name)
+            if name in self._groups:
+                subparser.setup_arguments()
+            else:
+                self._add_spec_to_parser(self._get_spec(name), subparser)
+
+    def _build_all_subparsers(self, arguments=True, groups=True):
+        '''Add all subparsers, with their arguments if arguments is True
+
+        Subparsers without arguments are enough to format the main parser's
+        help and usage. If groups is False, command groups are not set up
+        even if arguments is True.'''
+        if self._subparsers is None:
+            return
+        added_lazily = bool(self._subparsers.choices)
+        for name in self._subcommand_names():
+            if name in self._groups and arguments and groups:
+                if name not in self._built_commands:
+                    self._build_subparser(name)
+                self._subparsers.choices[name]._build_all_subparsers()
+            elif (arguments and name not in self._groups and
+                    name not in self._built_commands):
+                self._build_subparser(name)
+            else:
+                self._add_subparser(name)
+
+        if added_lazily:
+            # Restore registry order so that help and usage match those
+            # produced when all subparsers are built up front.
+            names = self._subcommand_names()
+            choices = self._subparsers.choices
+            ordered = [(name, choices.pop(name)) for name in names]
+            choices.update(ordered)
+            positions = dict((name, i) for i, name in enumerate(names))
+            self._subparsers._choices_actions.sort(
+                key=lambda action: positions[action.dest])
+
+    def _build_required_subparsers(self, argv):
+        '''Build only the subparser needed to parse argv
+
+        Falls back to building all subparsers when the subcommand cannot be
+        determined (errors, unusual options).'''
+        name, i = self._peek_command(argv)
+        if name is _HELP_REQUESTED:
+            # Main parser help exits before any subparser is used, and
+            # format_help() adds them if the help is not cached.
+            pass
+        elif name is None:
+            self._build_all_subparsers()
+        else:
+            if name not in self._built_commands:
+                self._build_subparser(name)
+            if name in self._groups:
+                self._subparsers.choices[name]._build_required_subparsers(
+                    argv[i + 1:])
+
+    def _peek_command(self, argv):
+        '''Find the subcommand in argv by skipping over main command options
+
+        Returns (name, its index in argv). name is None if it cannot be
+        unambiguously determined, or _HELP_REQUESTED if help is requested
+        before any subcommand.'''
+        if self.fromfile_prefix_chars:
+            return None, None
+        i = 0
+        while i < len(argv):
+            arg = argv[i]
+            if arg == '--':
+                return None, None
+            if len(arg) > 1 and arg[0] in self.prefix_chars:
+                option, sep, _ = arg.partition('=')
+                action = self._option_string_actions.get(option)
+                if action is None:
+                    # Short option with attached value, e.g. -a7.
+                    action = self._option_string_actions.get(arg[:2])
+                    if action is None or action.nargs == 0:
+                        return None, None
+                    sep = True
+                if action.dest == 'help':
+                    return (None if sep else _HELP_REQUESTED), None
+                if action.nargs == 0 and not sep:
+                    i += 1
+                elif action.nargs is None:
+                    i += 1 if sep else 2
+                else:
+                    return None, None
+                continue
+            if arg in self._commands or arg in self._groups:
+                return arg, i
+            return None, None
+        return None, None
+
+    def format_usage(self):
+        if self.lazy:
+            self._build_all_subparsers(arguments=False)
+        return super(CommandifyArgumentParser, self).format_usage()
+
+    def format_help(self):
+        '''Help for this parser, cached on disk if cache_dir was given
+
+        Subparsers' help is cached by the parser that added them.'''
+        path, key = self._help_cache()
+        if path is not None:
+            cache = _submodule('cache')
+            help = cache.load_cache(path, key)
+            if help is not None:
+                return help
+        if self.lazy:
+            self._build_all_subparsers(arguments=False)
+        self._add_command_help()
+        help = super(CommandifyArgumentParser, self).format_help()
+        if path is not None:
+            cache.save_cache(path, key, help)
+        return help
+
+    def _help_cache(self):
+        '''(path, key) for caching this parser's help, or (None, None)'''
+        parent = self._help_parent or self
+        if parent.cache_dir is None or parent._cache_path is None:
+            return None, None
+        if self._is_group or parent._is_group:
+            # Groups' commands are not included in the cache key.
+            return None, None
+        cache = _submodule('cache')
+        if self._help_parent is None:
+            path = cache.cache_path(parent.cache_dir, parent.prog, 'help')
+        else:
+            path = cache.cache_path(parent.cache_dir, parent.prog,
+                                    '{0}.help'.format(self._help_name))
+        # Help depends on the terminal width and Python version, as well as
+        # the commands.
+        import shutil
+        key = cache.registry_key([], parent._cache_key, self.prog,
+                                 self.usage, self.description, self.epilog,
+                                 self.formatter_class.__name__,
+                                 shutil.get_terminal_size().columns,
+                                 sys.version_info[:2])
+        return path, key
+
+    def pop_commandify_option(self, argv, option, takes_value=True):
+        '''Remove a built-in option, e.g. --commandify-completion, from argv
+
+        Returns the option's value (True if it takes no value), or None if
+        it is not present. If takes_value is None, the value is optional and
+        must be given as option=value.'''
+        for i, arg in enumerate(argv):
+            if arg == '--':
+                break
+            if takes_value is not False and arg.startswith(option + '='):
+                del argv[i]
+                return arg[len(option) + 1:]
+            if arg == option:
+                if not takes_value:
+                    del argv[i]
+                    return True
+                if i + 1 == len(argv):
+                    self.error('argument {0}: expected one argument'
+                               .format(option))
+                value = argv[i + 1]
+                del argv[i:i + 2]
+                return value
+        return None
+
+    def pop_commandify_int_option(self, argv, option, default):
+        '''As pop_commandify_option(...), for an option with an int value'''
+        value = self.pop_commandify_option(argv, option)
+        if value is None:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            self.error('argument {0}: invalid int value: {1!r}'
+                       .format(option, value))
+
+    def completion_index(self):
+        '''Option strings for the main command and all sub commands
+
+        Used by commandify.completion.fast_complete(...) to complete
+        without importing the commands.'''
+        def options(spec):
+            return [(arg_args, arg_kwargs.get('action') != 'store_true')
+                    for arg_args, arg_kwargs in spec['arguments']]
+
+        sources = set([os.path.abspath(sys.argv[0])])
+        for command_container in [self._main_commands, self._commands]:
+            for command, _, _ in command_container.values():
+                sources.add(_command_source(command))
+        help_options = (['-h', '--help'], False)
+        return {
+            'sources': dict((source, os.path.getmtime(source))
+                            for source in sources
+                            if source and os.path.exists(source)),
+            'main': [help_options] + options(self._main_spec),
+            # Command groups' own sub commands are not included.
+            'commands': [(name, [help_options] + options(self._get_spec(name)))
+                         for name in self._commands] +
+                        [(name, [help_options]) for name in self._groups],
+        }
+
+    def _add_spec_to_parser(self, spec, parser):
+        for kind, message in spec['warnings']:
+            self._warn(kind, message)
+        self.replaced_bool_args.extend(spec['replaced_bool_args'])
+        for arg_args, arg_kwargs in spec['arguments']:
+            parser.add_argument(*arg_args, **arg_kwargs)
+
+    def _command_spec(self, command, dec_args, dec_kwargs):
+        '''Work out the argparse arguments for a given command
+
+        The returned spec can be pickled, so that it can be cached. The
+        command's help is not included, see _command_help(...).'''
+        # Copied, as the registered options may be used by other parsers.
+        dec_kwargs = dict(dec_kwargs)
+        spec = {'arguments': [], 'replaced_bool_args': [], 'warnings': [],
+                'inputs': [], 'outputs': []}
+
+        # Loop over argument names and defaults (_NoDefaultClass if not set
+        # in the function signature), adding an argparse argument spec.
+        plan = _command_plan(command)
+        annotations = {}
+        if not isinstance(command, LazyCommand) or not command.static:
+            annotations = getattr(command, '__annotations__', None) or {}
+        for varname, option_name, default in zip(
+                plan.argument_names, plan.option_names, plan.defaults):
             if varname == 'args' or varname in self.provide_args:
                 # args is ignored so its default should not be set.
                 if default != _NoDefaultClass:
@@ -134,16 +993,27 @@ class CommandifyArgumentParser(ArgumentParser):
             # Get the decorator arguments which will be used in
             # parser.add_argument(...).
             if varname in dec_kwargs:
-                arg_kwargs = dec_kwargs.pop(varname)
+                arg_kwargs = dict(dec_kwargs.pop(varname))
             else:
                 arg_kwargs = {}
 
-            argname = varname.replace('_', '-')
-            arg_args = ['--{0}'.format(argname)]
+            argname = option_name[2:]
+            arg_args = [option_name]
             # 'flag' is a special arg. keyword, it (e.g. 'flag': '-a')
             if 'flag' in arg_kwargs:
                 flag = arg_kwargs.pop('flag')
                 arg_args.append(flag)
+            # As are 'input' and 'output', see commandify.incremental.
+            for kind in ['input', 'output']:
+                if arg_kwargs.pop(kind, False):
+                    spec[kind + 's'].append(varname)
+
+            # File arguments can be annotated, see commandify.filetypes.
+            if 'type' not in arg_kwargs and varname in annotations:
+                file_type = _submodule('filetypes').annotation_type(
+                    annotations[varname])
+                if file_type is not None:
+                    arg_kwargs['type'] = file_type
 
             # Default can either be set in the function arguments or as a an
             # option to the command(...) decorator.
@@ -159,15 +1029,15 @@ class CommandifyArgumentParser(ArgumentParser):
                     default_type = type(default)
                     if default_type == bool:
                         if default:
-                            self._warn('default_true',
-                                       'Setting {0} to not-{0}'
-                                       .format(argname))
+                            spec['warnings'].append(
+                                ('default_true',
+                                 'Setting {0} to not-{0}'.format(argname)))
                             # arg_kwargs['action'] = 'store_false'
                             # Idea: replace arg_args[0] with something like:
                             # arg_args[0] = '--not-' + arg_args[0][2:]
                             # Then handle this on parse_args.
                             negated_arg = '--not-' + arg_args[0][2:]
-                            self.replaced_bool_args.append(varname)
+                            spec['replaced_bool_args'].append(varname)
                             arg_args[0] = negated_arg
                             arg_kwargs['action'] = 'store_true'
                             default = False
@@ -175,70 +1045,436 @@ class CommandifyArgumentParser(ArgumentParser):
                             arg_kwargs['action'] = 'store_true'
                     elif not isinstance(default_type, type(None)):
                         arg_kwargs['type'] = default_type
-                parser.add_argument(*arg_args, default=default, **arg_kwargs)
+                arg_kwargs['default'] = default
             else:
                 # Any arguments without a default are required.
-                parser.add_argument(*arg_args, required=True, **arg_kwargs)
+                arg_kwargs['required'] = True
+            spec['arguments'].append((arg_args, arg_kwargs))
         # Check all decorator args have been accounted for.
         if dec_kwargs:
             raise CommandifyError('Unexpected command options: {0}'
                                   .format(', '.join(dec_kwargs.keys())))
 
-    def parse_args(self, *args, **kwargs):
-        self.args = super(CommandifyArgumentParser, self).parse_args(*args,
-                                                                     **kwargs)
-        # Replace not_some_arg=True with some_arg=False.
-        for varname in self.replaced_bool_args:
-            neg_varname = 'not_' + varname
-            if neg_varname in self.args:
-                neg_val = self.args.__dict__.pop(neg_varname)
-                self.args.__dict__[varname] = not neg_val
+        if spec['inputs'] or spec['outputs']:
+            if 'force' in plan.argument_names or\
+                    'dry_run' in plan.argument_names:
+                raise CommandifyError('Incremental command {0} cannot take '
+                                      'force or dry_run arguments'
+                                      .format(command.__name__))
+            spec['arguments'].extend(_submodule('incremental').OPTIONS)
+        return spec
+
+    def parse_args(self, args=None, namespace=None):
+        '''Parse args, which can chain sub commands separated by + if chain
+        is True
+
+        The args for each sub command after the first are in chained_args.
+        '''
+        argv = sys.argv[1:] if args is None else args
+        self.chained_args = []
+        segments = self._split_chain(argv)
+        if segments is None:
+            return self._parse_args(argv, namespace)
+        args = self._parse_args(segments[0], namespace)
+        # The main command's arguments are only given before the first sub
+        # command.
+        main_values = self._main_values(args)
+        self.chained_args = [self._sub_command_args(segment, main_values)
+                             for segment in segments[1:]]
+        return args
+
+    def _split_chain(self, argv):
+        '''argv split into the argv for each chained sub command, or None if
+        it does not chain sub commands'''
+        if not self.chain or '+' not in argv or self._is_group:
+            return None
+        segments = [[]]
+        for i, arg in enumerate(argv):
+            if arg == '+' and i + 1 < len(argv) and (
+                    argv[i + 1] in self._commands or
+                    argv[i + 1] in self._groups):
+                segments.append([])
+            else:
+                segments[-1].append(arg)
+        return segments if len(segments) > 1 else None
+
+    def _parse_args(self, argv, namespace=None):
+        with self._timed('parse_args'):
+            self.args = None
+            replaced_bool_args = self.replaced_bool_args
+            if self.fast_parse and namespace is None:
+                self.args, replaced_bool_args = self._fast_parse_args(argv)
+            if self.args is None:
+                if self.lazy or len(self._groups):
+                    self._build_required_subparsers(argv)
+                self.args = super(CommandifyArgumentParser, self).parse_args(
+                    argv, namespace)
+                replaced_bool_args = self.replaced_bool_args
+            self._replace_bool_args(self.args, replaced_bool_args)
 
         return self.args
 
+    def _replace_bool_args(self, args, replaced_bool_args):
+        with self._timed('replace_bool_args'):
+            # Replace not_some_arg=True with some_arg=False.
+            for varname in replaced_bool_args:
+                neg_varname = 'not_' + varname
+                if neg_varname in args:
+                    neg_val = args.__dict__.pop(neg_varname)
+                    args.__dict__[varname] = not neg_val
+
+    def _main_values(self, args):
+        '''Dict of the main command's arguments in args'''
+        values = {}
+        for action in self._actions:
+            dest = action.dest
+            if dest == self._command_dest:
+                continue
+            if dest.startswith('not_') and dest[4:] in self.replaced_bool_args:
+                dest = dest[4:]
+            if dest in args:
+                values[dest] = getattr(args, dest)
+        return values
+
+    def _sub_command_args(self, argv, values):
+        '''args for the sub command argv[0], parsed from the rest of argv by
+        its subparser, plus values (e.g. those of the main command)'''
+        with self._timed('parse_args'):
+            if self.lazy or len(self._groups):
+                self._build_required_subparsers(argv)
+            namespace = Namespace(**values)
+            setattr(namespace, self._command_dest, argv[0])
+            subparser = self._subparsers.choices[argv[0]]
+            args = super(CommandifyArgumentParser, subparser).parse_args(
+                argv[1:], namespace)
+            self._replace_bool_args(args, self.replaced_bool_args)
+        return args
+
+    def _fast_parse_args(self, argv):
+        '''(args, replaced_bool_args) parsed by commandify.fastparse, or
+        (None, None) if argparse is needed'''
+        main_options = self._get_fast_options(None)
+        if main_options is None:
+            return None, None
+        command_options = None
+        if len(self._commands):
+            def command_options(name):
+                if name not in self._commands:
+                    return None
+                return self._get_fast_options(name)
+        args = _submodule('fastparse').parse(argv, main_options,
+                                             command_options)
+        if args is None:
+            return None, None
+        replaced_bool_args = list(main_options.replaced_bool_args)
+        if getattr(args, 'command', None) is not None:
+            replaced_bool_args.extend(
+                self._fast_options[args.command].replaced_bool_args)
+        return args, replaced_bool_args
+
+    def _get_fast_options(self, name):
+        '''FastOptions for the sub command name, or the main command if name
+        is None'''
+        if name not in self._fast_options:
+            spec = self._main_spec if name is None else self._get_spec(name)
+            self._fast_options[name] = _submodule('fastparse').compile_spec(
+                spec)
+        return self._fast_options[name]
+
+    def parse_and_dispatch(self, args=None, namespace=None):
+        '''Parse args and dispatch the commands, see dispatch_commands()'''
+        self.parse_args(args, namespace)
+        return self.dispatch_commands()
+
     def dispatch_commands(self):
+        '''Run the main command and any sub command(s) parsed
+
+        Chained sub commands are run in turn, each given the previous one's
+        return value as args.prev_ret. Returns (main_ret, command_ret), with
+        the last sub command's return value.'''
         try:
-            if len(_commands):
-                if self.args.command is None:
-                    raise CommandifyError('too few arguments', 'user')
-
-            # Get arguments for both commands.
-            # Bad choice of name: main_command, clashes with function.
-            main_command, main_args, main_kwargs =\
-                list(_main_commands.values())[0]
-            main_command_args = self._get_command_args(main_command, self.args)
-            if len(_commands):
-                command, _, _ = _commands[self.args.command]
-                command_args = self._get_command_args(command, self.args)
+            calls = self._dispatch_calls(self.args)
+            chained_calls = [self._command_call(args)
+                             for args in self.chained_args]
+            if any(_is_coroutine_function(command)
+                   for command, _ in calls + chained_calls):
+                if chained_calls:
+                    raise CommandifyError('Async commands cannot be chained')
+                if len(calls) == 2 and self._requirements(self.args)[1]:
+                    raise CommandifyError('Async commands cannot require '
+                                          'other commands')
+                aio = _submodule('aio')
+                # Both commands share an event loop, so are run (and
+                # profiled) together.
+                name = (getattr(self.args, 'command', None) or
+                        list(self._main_commands)[0])
+                return self._run_command(
+                    'run_async_commands', name, aio.run,
+                    {'coroutine': aio.dispatch_calls(self.args, calls),
+                     'loop_factory': self.loop_factory})
 
             # Run commands.
-            main_ret = main_command(**main_command_args)
+            main_command, main_command_args = calls[0]
+            main_ret = self._run_command('main_command',
+                                         list(self._main_commands)[0],
+                                         main_command, main_command_args)
             self.args.main_ret = main_ret
-            if len(_commands):
-                command_ret = command(**command_args)
+            if len(calls) == 2:
+                command, command_args = calls[1]
+                # Return values of required commands, each run only once.
+                required_rets = {}
+                if _requiring_commands:
+                    self._run_required(self.args, required_rets)
+                command_ret = self._run_command('command', self.args.command,
+                                                command, command_args)
+                if self.chained_args:
+                    self._store_ret(self.args, command_ret, required_rets)
+                # Return values, e.g. generators, are passed on as they are,
+                # so can be consumed lazily by the next command.
+                for i, (command, command_args) in enumerate(chained_calls):
+                    args = self.chained_args[i]
+                    args.main_ret = main_ret
+                    args.prev_ret = command_ret
+                    if _requiring_commands:
+                        self._check_not_required(
+                            args, [self.args] + self.chained_args[:i],
+                            required_rets)
+                        self._run_required(args, required_rets)
+                    command_ret = self._run_command('command', args.command,
+                                                    command, command_args)
+                    self._store_ret(args, command_ret, required_rets)
                 return main_ret, command_ret
             else:
                 return main_ret, None
 
         except CommandifyError as e:
-            if e.error_type == 'user':
-                self.print_help()
-            self.exit(status=1,
-                      message='{0}: error: {1}\n'.format(self.prog, e))
+            self._handle_error(e)
+
+    def _requirements(self, args):
+        '''(parser, names) of the parser with the sub command selected by
+        args, and the names of the commands that sub command requires'''
+        name = getattr(args, self._command_dest, None)
+        if name in self._groups:
+            return self._subparsers.choices[name]._requirements(args)
+        return self, self._required_names(name)
+
+    def _required_names(self, name):
+        options = self._binding(self._commands[name][0]).options
+        return list(options.get('requires', []))
+
+    def _requirement_graph(self, name):
+        '''Dict of the names of the commands each command required by name,
+        directly or indirectly, requires
+
+        Only those commands are looked at, so that other lazily registered
+        commands are not imported. Unknown commands are left out.'''
+        requirements = {}
+        names = [name]
+        while names:
+            node = names.pop()
+            if node not in requirements and node in self._commands:
+                requirements[node] = self._required_names(node)
+                names.extend(requirements[node])
+        return requirements
+
+    def _run_required(self, args, required_rets):
+        '''Run the commands required by the sub command selected by args,
+        setting args.required_ret
+
+        required_rets has the return values of the commands already run for
+        each parser, by the name of the parser's sub command dest.'''
+        parser, required_names = self._requirements(args)
+        if not required_names:
+            return
+        dag = _submodule('dag')
+        if self.dag_executor not in dag.EXECUTORS:
+            raise CommandifyError('Unrecognised dag_executor {0}, expected '
+                                  'one of: {1}'.format(
+                                      self.dag_executor,
+                                      ', '.join(dag.EXECUTORS)))
+        name = getattr(args, parser._command_dest)
+        requirements = parser._requirement_graph(name)
+        try:
+            order = dag.required_order(name, requirements)
+        except ValueError as e:
+            raise CommandifyError(str(e))
+        rets = required_rets.setdefault(parser._command_dest, {})
+
+        # Parsed here, as parsing is not thread safe.
+        main_values = self._main_values(args)
+        calls = {}
+        for required_name in order:
+            if required_name in rets:
+                continue
+            if any(arg_kwargs.get('required') for _, arg_kwargs in
+                   parser._get_spec(required_name)['arguments']):
+                raise CommandifyError('{0} has required arguments, so cannot '
+                                      'be required'.format(required_name))
+            # With its default arguments.
+            required_args = parser._sub_command_args([required_name],
+                                                     main_values)
+            required_args.main_ret = args.main_ret
+            command, command_args = parser._command_call(required_args)
+            if _is_coroutine_function(command):
+                raise CommandifyError('Async command {0} cannot be required'
+                                      .format(required_name))
+            calls[required_name] = required_args, command, command_args
+
+        def run_command(required_name, required_ret):
+            required_args, command, command_args = calls[required_name]
+            required_args.required_ret = required_ret
+            return command(**command_args)
+
+        with self._timed('run_required', name):
+            dag.run_required(order, requirements, run_command, rets,
+                             self.dag_jobs, self.dag_executor)
+        args.required_ret = dict((required_name, rets[required_name])
+                                 for required_name in requirements[name])
+
+    def _check_not_required(self, args, previous_args, required_rets):
+        '''Raise CommandifyError if the sub command selected by args was run
+        as required by a sub command chained before it, which would
+        otherwise run it again'''
+        parser, _ = self._requirements(args)
+        name = getattr(args, parser._command_dest)
+        if name not in required_rets.get(parser._command_dest, {}):
+            return
+        if all(getattr(previous, parser._command_dest, None) != name
+               for previous in previous_args):
+            raise CommandifyError('{0} is required by a sub command chained '
+                                  'before it, so must be chained first'
+                                  .format(name))
+
+    def _store_ret(self, args, ret, required_rets):
+        '''Store the return value of the sub command selected by args, so
+        that it is not run again if required by a chained sub command'''
+        parser, _ = self._requirements(args)
+        rets = required_rets.setdefault(parser._command_dest, {})
+        rets[getattr(args, parser._command_dest)] = ret
+
+    def _run_command(self, phase, name, command, command_args):
+        '''command(**command_args), timed and profiled if enabled'''
+        with self._timed(phase, name):
+            if self.profile_dir is None:
+                return command(**command_args)
+            profiling = _submodule('profiling')
+            if self.profiler not in profiling.PROFILERS:
+                raise CommandifyError('Unrecognised profiler {0}, expected '
+                                      'one of: {1}'.format(
+                                          self.profiler,
+                                          ', '.join(profiling.PROFILERS)))
+            path_prefix = os.path.join(self.profile_dir,
+                                       '{0}.{1}'.format(self.prog, name))
+            return profiling.profile_call(command, command_args,
+                                          path_prefix, self.profiler)
+
+    def _dispatch_calls(self, args):
+        '''(command, command_args) for the main command and any sub command
+        selected by args'''
+        # Get arguments for both commands.
+        # Bad choice of name: main_command, clashes with function.
+        main_name = list(self._main_commands)[0]
+        main_command, main_args, main_kwargs = self._main_commands[main_name]
+        with self._timed('get_command_args', main_name):
+            main_command_args = self._get_command_args(main_command, args)
+            calls = [(self._dispatched_command(main_name, main_command,
+                                               self._main_spec, args),
+                      main_command_args)]
+        if len(self._commands) or len(self._groups):
+            calls.append(self._command_call(args))
+        return calls
+
+    def _command_call(self, args):
+        '''(command, command_args) for the sub command selected by args,
+        looking it up in command groups'''
+        name = getattr(args, self._command_dest, None)
+        if name is None:
+            raise CommandifyError('too few arguments', 'user')
+        if name in self._groups:
+            return self._subparsers.choices[name]._command_call(args)
+        command, _, _ = self._commands[name]
+        with self._timed('get_command_args', name):
+            command_args = self._get_command_args(command, args)
+            return (self._dispatched_command(name, command,
+                                             self._get_spec(name), args),
+                    command_args)
+
+    def _dispatched_command(self, name, command, spec, args):
+        '''command, or what stands in for it if its results are cached or
+        it is incremental (see commandify.memo and commandify.incremental)
+        '''
+        options = self._bindings[command].options
+        result_cache = options.get('cache')
+        map_reduce = options.get('map_reduce')
+        incremental = spec.get('inputs') or spec.get('outputs')
+        if not result_cache and not map_reduce and not incremental:
+            return command
+        if _is_coroutine_function(command):
+            raise CommandifyError('Async command {0} cannot be cached, map '
+                                  'reduced or incremental'.format(name))
+        dispatched = command
+        if map_reduce:
+            if map_reduce.input not in _command_plan(command).argument_names:
+                raise CommandifyError('map_reduce input {0} is not an '
+                                      'argument of {1}'.format(
+                                          map_reduce.input, name))
+            dispatched = _submodule('mapreduce').MapReduceCommand(
+                name, command, map_reduce, self._timed)
+        if result_cache:
+            if result_cache is True:
+                result_cache = self._default_result_cache()
+            dispatched = _CachedCommand(name, dispatched, result_cache,
+                                        self._timed)
+        if incremental:
+            dispatched = _submodule('incremental').IncrementalCommand(
+                name, dispatched, spec['inputs'], spec['outputs'],
+                self._bindings[command].parsed_names,
+                _submodule('cache').cache_path(
+                    self._cache_dir('incremental commands'),
+                    self._root_parser().prog, 'state'),
+                args.force, args.dry_run, sys.stdout)
+        return dispatched
+
+    def _root_parser(self):
+        '''The top level parser, which added any subparsers'''
+        if self._help_parent is not None:
+            return self._help_parent._root_parser()
+        return self
+
+    def _cache_dir(self, purpose):
+        '''The top level parser's cache_dir, needed for purpose'''
+        cache_dir = self._root_parser().cache_dir
+        if cache_dir is None:
+            raise CommandifyError('cache_dir must be given for {0}'
+                                  .format(purpose))
+        return cache_dir
+
+    def _default_result_cache(self):
+        '''The top level parser's result_cache, made if needed'''
+        root = self._root_parser()
+        if root.result_cache is None:
+            root.result_cache = _submodule('memo').ResultCache(
+                _submodule('cache').cache_path(
+                    self._cache_dir('cached command results'), root.prog,
+                    'results'))
+        return root.result_cache
+
+    def _binding(self, command):
+        binding = self._bindings.get(command)
+        if binding is None:
+            binding = self._bindings[command] = _CommandBinding(
+                _command_plan(command), self.provide_args,
+                _command_options.get(command, {}))
+        return binding
 
     def _get_command_args(self, command, args):
         '''Work out the command arguments for a given command'''
-        command_args = {}
-        command_argument_names =\
-            command.__code__.co_varnames[:command.__code__.co_argcount]
-
-        for varname in command_argument_names:
-            if varname == 'args':
-                command_args['args'] = args
-            elif varname in self.provide_args:
-                command_args[varname] = self.provide_args[varname]
-            else:
-                command_args[varname] = getattr(args, varname)
+        binding = self._binding(command)
+        command_args = dict(binding.provided)
+        for varname in binding.args_names:
+            command_args[varname] = args
+        for varname in binding.parsed_names:
+            command_args[varname] = getattr(args, varname)
         return command_args
 
 
@@ -246,18 +1482,116 @@ def commandify(use_argcomplete=False, exit=True, *args, **kwargs):
     '''Turns decorated functions into command line args
 
     Finds the main_command and all commands and generates command line args
-    from these.'''
+    from these.
+
+    Running with --commandify-completion bash|zsh|fish prints a static
+    shell completion script instead.
+
+    If batch is given (or --commandify-batch FILE is passed), each command
+    line in it is dispatched in turn, see commandify.batch. batch can be a
+    filename, '-' for stdin or a list of lines. If exit is False, the list of
+    (line_number, exit_status, (main_ret, command_ret)) is returned. The
+    lines are run in jobs worker processes (or --jobs N with batch), or
+    with up to concurrency async commands at once (or --concurrency N).
+
+    If daemon is given (or --commandify-daemon SOCKET is passed), command
+    lines sent by commandify_client to that Unix socket are served until
+    interrupted, see commandify.daemon.
+
+    Running with --commandify-profile DIR profiles the dispatched commands,
+    writing a profile for each to DIR, see commandify.profiling.
+
+    If timings is True (or --commandify-timings is passed), the time taken
+    by each phase, e.g. importing and setting up each command, is printed to
+    stderr as a table. If it is a filename (or --commandify-timings=FILE is
+    passed), the timings are written there as JSON, see commandify.timing.
+    '''
+    batch = kwargs.pop('batch', None)
+    jobs = kwargs.pop('jobs', 1)
+    concurrency = kwargs.pop('concurrency', 1)
+    daemon = kwargs.pop('daemon', None)
+    timings = kwargs.pop('timings', None)
     parser = CommandifyArgumentParser(*args, **kwargs)
+    argv = sys.argv[1:]
+    timings = parser.pop_commandify_option(argv, '--commandify-timings',
+                                           takes_value=None) or timings
+    parser.profile_dir = parser.pop_commandify_option(
+        argv, '--commandify-profile') or parser.profile_dir
+    if timings:
+        parser.timings = _submodule('timing').Timings()
+        # Mostly the time taken to import the command modules.
+        parser.timings.add('import', None, time.perf_counter() - _import_time)
+    try:
+        return _commandify(parser, argv, use_argcomplete, exit, batch, jobs,
+                           concurrency, daemon)
+    finally:
+        if timings:
+            registry = parser.registry
+            for command_container in [registry.main_commands,
+                                      registry.commands]:
+                for name, (command, _, _) in command_container.items():
+                    if getattr(command, 'import_seconds', None) is not None:
+                        parser.timings.add('lazy_import', name,
+                                           command.import_seconds)
+            parser.timings.write(timings, sys.stderr)
+
+
+def _commandify(parser, argv, use_argcomplete, exit, batch, jobs,
+                concurrency, daemon):
+    '''Set up parser, then run the command line(s) as commandify(...)'''
+    completion_shell = parser.pop_commandify_option(argv,
+                                                    '--commandify-completion')
+    batch = parser.pop_commandify_option(argv, '--commandify-batch') or batch
+    if batch is not None:
+        jobs = parser.pop_commandify_int_option(argv, '--jobs', jobs)
+        concurrency = parser.pop_commandify_int_option(argv, '--concurrency',
+                                                       concurrency)
+    daemon = parser.pop_commandify_option(argv,
+                                          '--commandify-daemon') or daemon
+    if (batch is not None or daemon is not None) and argv:
+        parser.error('unrecognized arguments: {0}'.format(' '.join(argv)))
     parser.setup_arguments()
+    if completion_shell is not None:
+        completion_script = _submodule('completion').completion_script
+        try:
+            print(completion_script(parser.completion_index(),
+                                    completion_shell, parser.prog))
+        except ValueError as e:
+            parser.error(str(e))
+        parser.exit(0)
+
+    if daemon is not None:
+        _submodule('daemon').serve(parser, daemon)
+        parser.exit(0)
+
+    if batch is not None:
+        batch_module = _submodule('batch')
+        results = batch_module.run_batch(
+            parser, batch_module.read_batch(batch), jobs, concurrency)
+        if exit:
+            failed = any(status != 0 for _, status, _ in results)
+            parser.exit(1 if failed else 0)
+        return results
+
     if use_argcomplete:
         try:
             import argcomplete
         except ImportError:
             print('argcomplete not installed, please install it.')
             parser.exit(status=2)
+        if parser.cache_dir is not None and '_ARGCOMPLETE' in os.environ:
+            # Allow commandify.completion.fast_complete(...) to answer
+            # future completions.
+            cache = _submodule('cache')
+            cache.save_cache(
+                cache.cache_path(parser.cache_dir, parser.prog, 'complete'),
+                cache.COMPLETION_INDEX_KEY, parser.completion_index())
+        # argcomplete can show sub commands' help.
+        parser._add_command_help()
         # Must happen between setup_arguments() and parse_args().
-        argcomplete.autocomplete(parser)
-    args = parser.parse_args()
+        with parser._timed('argcomplete'):
+            argcomplete.autocomplete(parser)
+    args = parser.parse_args(argv)
     if exit:
         parser.dispatch_commands()
         parser.exit(0)
@@ -0,0 +1,274 @@
+'''Shell completion without importing the commands
+
+commandify(use_argcomplete=True, cache_dir=...) saves an index of the sub
+commands and their options when argcomplete is first used. Calling
+fast_complete(...) at the top of a script, before the command modules are
+imported, answers later completions from this index::
+
+    #!/usr/bin/env python
+    # PYTHON_ARGCOMPLETE_OK
+    from commandify.completion import fast_complete
+    fast_complete('/path/to/cache_dir')
+
+    from mytool.commands import *  # Slow imports.
+    ...
+
+Alternatively, completion_script(...) generates native bash, zsh or fish
+completion scripts, which are output by running a commandify script with
+--commandify-completion bash|zsh|fish.
+'''
+import os
+import re
+import shlex
+import sys
+
+try:
+    from .cache import cache_path, load_cache, COMPLETION_INDEX_KEY
+except (ImportError, ValueError):
+    # Imported as a top level module, see commandify.commandify.
+    from cache import cache_path, load_cache, COMPLETION_INDEX_KEY
+
+
+def fast_complete(cache_dir, prog=None, exit_method=os._exit):
+    '''Answer an argcomplete request from the completion index and exit
+
+    Does nothing if not completing, or if the index is missing or any of
+    the commands' source files have changed since it was saved.'''
+    if '_ARGCOMPLETE' not in os.environ:
+        return
+    prog = prog or os.path.basename(sys.argv[0])
+    index = load_cache(cache_path(cache_dir, prog, 'complete'),
+                       COMPLETION_INDEX_KEY)
+    if index is None or not _index_fresh(index):
+        return
+
+    comp_line = os.environ['COMP_LINE']
+    comp_point = int(os.environ.get('COMP_POINT', len(comp_line)))
+    completions = complete(index, comp_line, comp_point)
+    if completions is None:
+        return
+
+    ifs = os.environ.get('_ARGCOMPLETE_IFS', '\013')
+    if '_ARGCOMPLETE_STDOUT_FILENAME' in os.environ:
+        output_stream = open(os.environ['_ARGCOMPLETE_STDOUT_FILENAME'], 'w')
+    else:
+        output_stream = os.fdopen(8, 'w')
+    output_stream.write(ifs.join(completions))
+    output_stream.flush()
+    output_stream.close()
+    exit_method(0)
+
+
+def complete(index, comp_line, comp_point):
+    '''Completions for the word being typed at comp_point in comp_line
+
+    Returns None if the line cannot be split into words.'''
+    line = comp_line[:comp_point]
+    try:
+        words = shlex.split(line)
+    except ValueError:
+        # E.g. an unclosed quote, leave it to argcomplete.
+        return None
+    if line and not line[-1].isspace() and words:
+        prefix = words.pop()
+    else:
+        prefix = ''
+
+    commands = dict(index['commands'])
+    options = index['main']
+    # Skip over the program name, then find any sub command.
+    i = 1
+    while i < len(words):
+        word = words[i]
+        takes_value = _takes_value(options, word)
+        if takes_value is None and options is index['main']:
+            if word in commands:
+                options = commands[word]
+            elif not word.startswith('-'):
+                return []
+        i += 2 if takes_value else 1
+        if i == len(words) + 1:
+            # Completing the value of an option.
+            return []
+
+    if prefix.startswith('-'):
+        return [option_string
+                for option_strings, _ in options
+                for option_string in option_strings
+                if option_string.startswith(prefix)]
+    if options is index['main']:
+        return [name for name, _ in index['commands']
+                if name.startswith(prefix)]
+    return []
+
+
+def _takes_value(options, word):
+    '''Whether word is an option that is followed by a value
+
+    Returns None if word is not one of options.'''
+    if '=' in word:
+        return False if word.startswith('-') else None
+    for option_strings, takes_value in options:
+        if word in option_strings:
+            return takes_value
+    return None
+
+
+def _index_fresh(index):
+    for source, mtime in index['sources'].items():
+        try:
+            if os.path.getmtime(source) != mtime:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def completion_script(index, shell, prog):
+    '''Static completion script for bash, zsh or fish
+
+    The script needs no Python to be run when completing. index is as
+    returned by CommandifyArgumentParser.completion_index().'''
+    generators = {
+        'bash': _bash_script,
+        'zsh': _zsh_script,
+        'fish': _fish_script,
+    }
+    if shell not in generators:
+        raise ValueError('Unrecognised shell {0}, expected one of: {1}'
+                         .format(shell, ', '.join(sorted(generators))))
+    return generators[shell](index, prog, re.sub(r'\W', '_', prog))
+
+
+def _option_strings(options, takes_value=None):
+    return [option_string
+            for option_strings, option_takes_value in options
+            if takes_value is None or option_takes_value == takes_value
+            for option_string in option_strings]
+
+
+def _bash_script(index, prog, func_name):
+    command_names = [name for name, _ in index['commands']]
+    main_value_options = _option_strings(index['main'], takes_value=True)
+    lines = [
+        '# bash completion for {0}, generated by commandify'.format(prog),
+        '_{0}_complete() {{'.format(func_name),
+        '    local cur="${COMP_WORDS[COMP_CWORD]}"',
+        '    local prev="${COMP_WORDS[COMP_CWORD-1]}"',
+        '    local cmd="" opts="" values="" i',
+        '    for ((i=1; i < COMP_CWORD; i++)); do',
+        '        case "${COMP_WORDS[i]}" in',
+    ]
+    if main_value_options:
+        # Skip option values, including those after an = word break.
+        lines += [
+            '            {0})'.format('|'.join(main_value_options)),
+            '                [[ "${COMP_WORDS[i+1]}" == = ]] && ((i++))',
+            '                ((i++));;',
+        ]
+    if command_names:
+        lines.append('            {0}) cmd="${{COMP_WORDS[i]}}"; break;;'
+                     .format('|'.join(command_names)))
+    lines += [
+        '        esac',
+        '    done',
+        '    case "$cmd" in',
+    ]
+    for name, options in [('""', index['main'])] + index['commands']:
+        lines.append('        {0}) opts="{1}"; values="{2}";;'.format(
+            name, ' '.join(_option_strings(options)),
+            ' '.join(_option_strings(options, takes_value=True))))
+    lines += [
+        '    esac',
+        '    COMPREPLY=()',
+        # Fall back to default (filename) completion for option values.
+        '    [[ " $values " == *" $prev "* ]] && return',
+        '    if [[ "$cur" == -* ]]; then',
+        '        COMPREPLY=($(compgen -W "$opts" -- "$cur"))',
+        '    elif [[ -z "$cmd" ]]; then',
+        '        COMPREPLY=($(compgen -W "{0}" -- "$cur"))'.format(
+            ' '.join(command_names)),
+        '    fi',
+        '}',
+        'complete -o default -F _{0}_complete {1}'.format(func_name, prog),
+        '',
+    ]
+    return '\n'.join(lines)
+
+
+def _zsh_script(index, prog, func_name):
+    command_names = [name for name, _ in index['commands']]
+    main_value_options = _option_strings(index['main'], takes_value=True)
+    lines = [
+        '#compdef {0}'.format(prog),
+        '# zsh completion for {0}, generated by commandify'.format(prog),
+        '_{0}() {{'.format(func_name),
+        '    local cmd="" i',
+        '    local -a opts values',
+        '    for ((i=2; i < CURRENT; i++)); do',
+        '        case "${words[i]}" in',
+    ]
+    if main_value_options:
+        lines.append('            {0}) ((i++));;'.format(
+            '|'.join(main_value_options)))
+    if command_names:
+        lines.append('            {0}) cmd="${{words[i]}}"; break;;'
+                     .format('|'.join(command_names)))
+    lines += [
+        '        esac',
+        '    done',
+        '    case "$cmd" in',
+    ]
+    for name, options in [('""', index['main'])] + index['commands']:
+        lines.append('        {0}) opts=({1}); values=({2});;'.format(
+            name, ' '.join(_option_strings(options)),
+            ' '.join(_option_strings(options, takes_value=True))))
+    lines += [
+        '    esac',
+        '    if (( ${values[(Ie)${words[CURRENT-1]}]} )); then',
+        '        _files',
+        '    elif [[ "$PREFIX" == -* ]]; then',
+        '        compadd -a opts',
+        '    elif [[ -z "$cmd" ]]; then',
+        '        compadd {0}'.format(' '.join(command_names)),
+        '    else',
+        '        _files',
+        '    fi',
+        '}',
+        'compdef _{0} {1}'.format(func_name, prog),
+        '',
+    ]
+    return '\n'.join(lines)
+
+
+def _fish_option(option_strings):
+    parts = []
+    for option_string in option_strings:
+        if option_string.startswith('--'):
+            parts.append('-l {0}'.format(option_string[2:]))
+        elif len(option_string) == 2:
+            parts.append('-s {0}'.format(option_string[1:]))
+        else:
+            parts.append('-o {0}'.format(option_string[1:]))
+    return ' '.join(parts)
+
+
+def _fish_script(index, prog, func_name):
+    command_names = [name for name, _ in index['commands']]
+    lines = [
+        '# fish completion for {0}, generated by commandify'.format(prog),
+    ]
+    if command_names:
+        lines.append('complete -c {0} -f -n __fish_use_subcommand -a "{1}"'
+                     .format(prog, ' '.join(command_names)))
+    conditions = [('__fish_use_subcommand', index['main'])]
+    for name, options in index['commands']:
+        conditions.append(('"__fish_seen_subcommand_from {0}"'.format(name),
+                           options))
+    for condition, options in conditions:
+        for option_strings, takes_value in options:
+            lines.append('complete -c {0} -n {1} {2}{3}'.format(
+                prog, condition, _fish_option(option_strings),
+                ' -r' if takes_value else ''))
+    lines.append('')
+    return '\n'.join(lines)
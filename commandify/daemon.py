@@ -0,0 +1,138 @@
+'''Serving commands from a long-lived process over a Unix socket
+
+The daemon imports the commands and builds the parser once. The
+commandify_client script forwards its argv, working directory, environment
+and stdin/stdout/stderr to the daemon, which forks a child to run each
+command line and replies with the exit status::
+
+    commandify_examples --commandify-daemon /tmp/examples.sock &
+    commandify_client /tmp/examples.sock cmd1 --name a1
+
+Protocol: the client sends a 4 byte big-endian length then a payload of
+null separated fields (cwd, number of args, args..., KEY=VALUE environment
+entries), passing its stdin, stdout and stderr file descriptors alongside
+using SCM_RIGHTS. The daemon replies with the exit status as a 4 byte
+big-endian signed int.
+'''
+import array
+import io
+import os
+import signal
+import socket
+import struct
+import sys
+
+try:
+    from .batch import run_command_line
+    from .commandify import LazyCommand
+except (ImportError, ValueError):
+    # Imported as a top level module, see commandify.commandify.
+    from batch import run_command_line
+    from commandify import LazyCommand
+
+_HEADER = struct.Struct('!I')
+_STATUS = struct.Struct('!i')
+
+
+def serve(parser, socket_path):
+    '''Serve command lines sent to socket_path until interrupted
+
+    parser must already have had setup_arguments() called.'''
+    # Do all the expensive work once, rather than in every child.
+    for command_container in [parser.registry.main_commands,
+                              parser.registry.commands]:
+        for command, _, _ in command_container.values():
+            if isinstance(command, LazyCommand):
+                command.resolve()
+    parser._build_all_subparsers()
+
+    if os.path.exists(socket_path):
+        # Left behind by a previous daemon.
+        os.remove(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    # Only the daemon's user may run commands, set before connections are
+    # accepted.
+    os.chmod(socket_path, 0o600)
+    server.listen(128)
+    # Children are not waited for, so have them reaped automatically.
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    # Clean up the socket when terminated.
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        while True:
+            conn, _ = server.accept()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                server.close()
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                status = 1
+                try:
+                    status = _handle_connection(parser, conn)
+                finally:
+                    os._exit(status)
+            conn.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.remove(socket_path)
+
+
+def _terminate(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def _handle_connection(parser, conn):
+    '''Run the command line sent over conn in this (child) process'''
+    cwd, argv, environ, fds = _receive_request(conn)
+    for fd, std_fd in zip(fds, [0, 1, 2]):
+        os.dup2(fd, std_fd)
+        os.close(fd)
+    # The daemon's own sys.stdout etc. may not write to its file
+    # descriptors, e.g. if they were replaced to capture output.
+    sys.stdin = io.open(0, 'r', closefd=False)
+    sys.stdout = io.open(1, 'w', closefd=False)
+    sys.stderr = io.open(2, 'w', closefd=False)
+    os.chdir(cwd)
+    os.environ.clear()
+    os.environ.update(environ)
+    sys.argv = [parser.prog] + argv
+
+    status, _ = run_command_line(parser, argv)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    conn.sendall(_STATUS.pack(status))
+    conn.close()
+    return status
+
+
+def _receive_request(conn):
+    fds = array.array('i')
+    header, ancdata, _, _ = conn.recvmsg(
+        _HEADER.size, socket.CMSG_SPACE(3 * fds.itemsize))
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - len(data) % fds.itemsize])
+    header += _receive_exactly(conn, _HEADER.size - len(header))
+    payload = _receive_exactly(conn, _HEADER.unpack(header)[0])
+
+    fields = [os.fsdecode(field) for field in payload.split(b'\0')]
+    cwd, num_args = fields[0], int(fields[1])
+    argv = fields[2:2 + num_args]
+    environ = dict(entry.split('=', 1) for entry in fields[2 + num_args:]
+                   if '=' in entry)
+    return cwd, argv, environ, list(fds)
+
+
+def _receive_exactly(conn, size):
+    data = b''
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise EOFError('Connection closed by client')
+        data += chunk
+    return data
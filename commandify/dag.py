@@ -0,0 +1,125 @@
+'''Running the commands a command requires before it
+
+Commands can require other sub commands, which are run first::
+
+    @command
+    def fetch(url='https://example.com/data'):
+        ...
+
+    @command(requires=['fetch'])
+    def index(args):
+        data = args.required_ret['fetch']
+        ...
+
+    @command(requires=['fetch', 'index'])
+    def report(args, month='jan'):
+        ...
+
+Running tool report runs fetch, then index, then report. Every command
+required directly or indirectly is run once per command line (including
+chained sub commands), as soon as the commands it requires have run, so
+independent commands run concurrently. They are run by a pool of dag_jobs
+threads, or with dag_executor='process' a pool of worker processes forked
+from the process that built the parser, in which case return values must
+be picklable. Each command is given the return values of the commands it
+requires as args.required_ret, a dict of command name to return value.
+
+A required command can be chained before the commands requiring it, e.g.
+tool fetch + report, but not after them, as it would be run twice.
+
+Required commands are run with their default arguments, so cannot have
+required arguments.
+'''
+import sys
+
+EXECUTORS = ['thread', 'process']
+
+# The function running commands in worker processes, inherited when they
+# are forked.
+_worker_run_command = None
+
+
+def required_order(name, requirements):
+    '''Commands required by name, directly or indirectly, each after those
+    it requires
+
+    requirements maps command names to the names they require. Raises
+    ValueError if a command is unknown, or commands require each other.'''
+    order = []
+    visiting = []
+
+    def visit(node):
+        if node in order:
+            return
+        if node in visiting:
+            cycle = visiting[visiting.index(node):] + [node]
+            raise ValueError('Commands require each other: {0}'
+                             .format(' -> '.join(cycle)))
+        visiting.append(node)
+        for required in requirements[node]:
+            if required not in requirements:
+                raise ValueError('{0} requires unknown command {1}'
+                                 .format(node, required))
+            visit(required)
+        visiting.pop()
+        order.append(node)
+    visit(name)
+    return order[:-1]
+
+
+def run_required(order, requirements, run_command, rets, jobs=None,
+                 executor='thread'):
+    '''Run each command in order not already in rets, storing its return
+    value there
+
+    run_command(name, required_rets) runs a command, given the return
+    values of those it requires. Commands are run in a pool of jobs threads
+    or processes, as soon as all of the commands they require have run.'''
+    global _worker_run_command
+    import multiprocessing
+    from concurrent.futures import wait, FIRST_COMPLETED
+    if executor not in EXECUTORS:
+        raise ValueError('Unrecognised dag_executor {0}, expected one of: '
+                         '{1}'.format(executor, ', '.join(EXECUTORS)))
+    pending = [name for name in order if name not in rets]
+    if not pending:
+        return rets
+
+    if executor == 'process':
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            # Workers could not inherit the commands.
+            sys.stderr.write('warning: cannot fork, running required '
+                             'commands in threads\n')
+            executor = 'thread'
+    if executor == 'process':
+        from concurrent.futures import ProcessPoolExecutor
+        _worker_run_command = run_command
+        pool = ProcessPoolExecutor(
+            jobs, mp_context=multiprocessing.get_context('fork'))
+        submit_command = _run_worker_command
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        pool = ThreadPoolExecutor(jobs)
+        submit_command = run_command
+
+    running = {}
+    try:
+        while pending or running:
+            for name in list(pending):
+                if all(required in rets for required in requirements[name]):
+                    pending.remove(name)
+                    required_rets = dict((required, rets[required])
+                                         for required in requirements[name])
+                    running[pool.submit(submit_command, name,
+                                        required_rets)] = name
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                rets[running.pop(future)] = future.result()
+    finally:
+        pool.shutdown()
+        _worker_run_command = None
+    return rets
+
+
+def _run_worker_command(name, required_rets):
+    return _worker_run_command(name, required_rets)
@@ -0,0 +1,131 @@
+'''Parsing simple command lines without argparse
+
+Used by CommandifyArgumentParser(fast_parse=True). Command lines made up
+only of --option value, --option=value and boolean flag options, with the
+sub command name after the main command's options, are parsed directly
+into the Namespace argparse would give. Anything else (errors, help,
+abbreviations, short flags with attached values, values starting with -,
+options with e.g. nargs or choices) makes parse() return None, and the
+command line is left to argparse.
+'''
+from argparse import Namespace
+
+# arg_kwargs that do not change how a simple option is parsed.
+_SIMPLE_KWARGS = set(['action', 'type', 'default', 'required', 'help',
+                      'metavar'])
+# Types whose values can be shared between parses.
+_VALUE_TYPES = set([str, int, float, complex])
+
+
+class FastOptions(object):
+    '''Options of one command, compiled from its argument spec
+
+    options maps each option string to (dest, type, takes_value).'''
+    __slots__ = ('options', 'defaults', 'required', 'replaced_bool_args')
+
+    def __init__(self, options, defaults, required, replaced_bool_args):
+        self.options = options
+        self.defaults = defaults
+        self.required = required
+        self.replaced_bool_args = replaced_bool_args
+
+
+def compile_spec(spec):
+    '''FastOptions for a command's spec, or None if any of its arguments
+    need argparse'''
+    options, defaults, required = {}, {}, []
+    for arg_args, arg_kwargs in spec['arguments']:
+        if not _SIMPLE_KWARGS.issuperset(arg_kwargs):
+            return None
+        action = arg_kwargs.get('action', 'store')
+        if action not in ('store', 'store_true'):
+            return None
+        dest = arg_args[0][2:].replace('-', '_')
+        takes_value = action == 'store'
+        arg_type = arg_kwargs.get('type')
+        if takes_value:
+            default = arg_kwargs.get('default')
+            if isinstance(default, str) and arg_type is not None:
+                # As argparse, which converts string defaults. Only for
+                # value types, as the default is shared between parses and
+                # other types may e.g. open files.
+                if arg_type not in _VALUE_TYPES:
+                    return None
+                try:
+                    default = arg_type(default)
+                except Exception:
+                    return None
+        else:
+            default = arg_kwargs.get('default', False)
+        defaults[dest] = default
+        if arg_kwargs.get('required'):
+            required.append(dest)
+        for option_string in arg_args:
+            options[option_string] = (dest, arg_type, takes_value)
+    return FastOptions(options, defaults, required,
+                       list(spec['replaced_bool_args']))
+
+
+def parse(argv, main_options, command_options=None):
+    '''Namespace for argv, or None if argparse is needed to parse it
+
+    command_options is a function returning FastOptions (or None) for a sub
+    command name, or None if there are no sub commands.'''
+    namespace = Namespace(**main_options.defaults)
+    if command_options is not None:
+        namespace.command = None
+    options = main_options
+    seen = set()
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        i += 1
+        if not arg.startswith('-') or arg == '-':
+            if options is not main_options or command_options is None:
+                return None
+            options = command_options(arg)
+            if options is None:
+                return None
+            if not _check_required(main_options, seen):
+                return None
+            seen = set()
+            namespace.command = arg
+            namespace.__dict__.update(options.defaults)
+            continue
+
+        option_string, sep, value = arg.partition('=')
+        if sep and not option_string.startswith('--'):
+            # E.g. -a=7, which argparse versions handle differently.
+            return None
+        option = options.options.get(option_string)
+        if option is None:
+            return None
+        dest, arg_type, takes_value = option
+        if not takes_value:
+            if sep:
+                return None
+            value = True
+        else:
+            if not sep:
+                if i == len(argv) or argv[i].startswith('-'):
+                    return None
+                value = argv[i]
+                i += 1
+            if arg_type is not None:
+                try:
+                    value = arg_type(value)
+                except Exception:
+                    return None
+        setattr(namespace, dest, value)
+        seen.add(dest)
+
+    if not _check_required(options, seen):
+        return None
+    return namespace
+
+
+def _check_required(options, seen):
+    for dest in options.required:
+        if dest not in seen:
+            return False
+    return True
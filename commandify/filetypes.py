@@ -0,0 +1,148 @@
+'''Argument types giving commands file contents without reading them
+
+These can be given as an argument's type, e.g.
+@command(data={'type': mapped}), or are used for arguments annotated with
+memoryview, numpy.memmap or io.BufferedReader::
+
+    @command
+    def checksum(data: memoryview):
+        return zlib.crc32(data)
+
+mapped gives a read only memoryview of the memory mapped file, and
+MemmapType a numpy.memmap (or, if numpy is not installed, such a
+memoryview), so that large files can be processed without copying them
+into memory. LazyFile gives a buffered file, opened when first used.
+
+Only LazyFiles can be used as input or output arguments of incremental
+commands, or as arguments of commands whose results are cached, as
+memoryviews cannot be pickled or compared between runs.
+'''
+import io
+import mmap
+import os
+import sys
+from argparse import ArgumentTypeError
+
+
+def mapped(path):
+    '''A read only memoryview of the memory mapped file at path'''
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # Empty files cannot be memory mapped.
+                return memoryview(b'')
+            # The mapping stays open after the file is closed.
+            return memoryview(mmap.mmap(f.fileno(), 0,
+                                        access=mmap.ACCESS_READ))
+    except (IOError, OSError) as e:
+        raise ArgumentTypeError("can't map '{0}': {1}".format(path, e))
+
+
+class MemmapType(object):
+    '''Argument type giving a numpy.memmap of a file
+
+    dtype, mode, offset and shape are passed to numpy.memmap(...). If numpy
+    is not installed, a memoryview as from mapped(...) is given instead,
+    which is only possible in read only mode.'''
+    def __init__(self, dtype='uint8', mode='r', offset=0, shape=None):
+        self.dtype = dtype
+        self.mode = mode
+        self.offset = offset
+        self.shape = shape
+
+    def __call__(self, path):
+        try:
+            # Imported here as numpy is slow to import, and optional.
+            import numpy
+        except ImportError:
+            if self.mode != 'r' or self.offset:
+                raise ArgumentTypeError('numpy is needed to map {0}'
+                                        .format(path))
+            return mapped(path)
+        try:
+            return numpy.memmap(path, dtype=self.dtype, mode=self.mode,
+                                offset=self.offset, shape=self.shape)
+        except (IOError, OSError, ValueError) as e:
+            raise ArgumentTypeError("can't map '{0}': {1}".format(path, e))
+
+    def __repr__(self):
+        return 'MemmapType({0!r}, {1!r}, {2!r}, {3!r})'.format(
+            self.dtype, self.mode, self.offset, self.shape)
+
+
+class LazyFile(object):
+    '''A buffered file, only opened when first used
+
+    Attribute access (e.g. read or readinto) is forwarded to the file. '-'
+    is stdin. As it refers to a path, a LazyFile can be used wherever a
+    path can, e.g. os.path.getsize(lazy_file).'''
+    def __init__(self, path, mode='rb', buffering=-1):
+        if path != '-' and 'r' in mode and not os.path.isfile(path):
+            raise ArgumentTypeError("can't open '{0}': no such file"
+                                    .format(path))
+        self.name = path
+        self.mode = mode
+        self.buffering = buffering
+        self._file = None
+
+    @property
+    def file(self):
+        '''The opened file'''
+        if self._file is None:
+            if self.name == '-':
+                self._file = sys.stdin.buffer if 'b' in self.mode\
+                    else sys.stdin
+            else:
+                self._file = io.open(self.name, self.mode, self.buffering)
+        return self._file
+
+    def close(self):
+        if self._file is not None and self.name != '-':
+            self._file.close()
+
+    def __fspath__(self):
+        return self.name
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            # E.g. looked up while being copied or pickled.
+            raise AttributeError(name)
+        return getattr(self.file, name)
+
+    def __iter__(self):
+        return iter(self.file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def __repr__(self):
+        return 'LazyFile({0!r}, {1!r})'.format(self.name, self.mode)
+
+
+# Annotations as strings, e.g. with from __future__ import annotations.
+_STRING_ANNOTATIONS = {
+    'memoryview': memoryview,
+    'io.BufferedReader': io.BufferedReader,
+    'BufferedReader': io.BufferedReader,
+}
+
+
+def annotation_type(annotation):
+    '''The argument type for arguments annotated with annotation, or None
+    '''
+    if isinstance(annotation, str):
+        if annotation in ['numpy.memmap', 'np.memmap']:
+            return MemmapType()
+        annotation = _STRING_ANNOTATIONS.get(annotation)
+    if annotation is memoryview:
+        return mapped
+    if annotation is io.BufferedReader:
+        return LazyFile
+    # Checked by name, so that numpy is not imported.
+    if (getattr(annotation, '__name__', None) == 'memmap' and
+            getattr(annotation, '__module__', '').startswith('numpy')):
+        return MemmapType()
+    return None
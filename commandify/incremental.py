@@ -0,0 +1,155 @@
+'''Make-style incremental commands, skipped when their inputs are unchanged
+
+A command's file arguments are declared as inputs or outputs in their
+decorator options, and can be a path or a list of paths (e.g. with
+nargs='+')::
+
+    @command(source={'input': True}, report={'output': True})
+    def summarise(source, report, month='jan'):
+        ...
+
+The command is then skipped if it has already been run with the same
+arguments, its code has not changed, all of its outputs exist and the
+contents of its inputs are unchanged. Inputs are only hashed if their
+modification time or size has changed since the last run, so touching an
+input does not re-run the command. What was recorded for each run is
+kept in a state file, CACHE_DIR/PROG.state, where CACHE_DIR is the parser's
+cache_dir.
+
+Incremental commands get two extra options: --force to run the command
+anyway, and --dry-run to print whether it would be run, and why, without
+running it.
+'''
+import hashlib
+import os
+
+try:
+    from .cache import function_fingerprint, load_cache, save_cache
+except (ImportError, ValueError):
+    # Imported as a top level module, see commandify.commandify.
+    from cache import function_fingerprint, load_cache, save_cache
+
+STATE_KEY = 'incremental-state-1'
+
+# Options added to incremental commands, as (arg_args, arg_kwargs).
+OPTIONS = [
+    (['--force'], {'action': 'store_true', 'default': False,
+                   'help': 'run even if the outputs are up to date'}),
+    (['--dry-run'], {'action': 'store_true', 'default': False,
+                     'help': 'report whether the command would run, '
+                     'without running it'}),
+]
+
+_CHUNK_SIZE = 1 << 20
+
+
+class IncrementalCommand(object):
+    '''Stands in for an incremental command, only calling it if it is out
+    of date
+
+    inputs and outputs are the names of the command's file arguments, and
+    key_names those of its arguments that identify a run. If dry_run is
+    True, whether the command would be run is written to stream instead.'''
+    def __init__(self, name, command, inputs, outputs, key_names, state_path,
+                 force=False, dry_run=False, stream=None):
+        self.name = name
+        self.command = command
+        self.inputs = inputs
+        self.outputs = outputs
+        self.key_names = key_names
+        self.state_path = state_path
+        self.force = force
+        self.dry_run = dry_run
+        self.stream = stream
+
+    def __call__(self, **command_args):
+        state = load_cache(self.state_path, STATE_KEY) or {}
+        key = repr((self.name, sorted((varname, command_args[varname])
+                                      for varname in self.key_names)))
+        code = hashlib.sha1(function_fingerprint(self.command)).hexdigest()
+        input_states = {}
+        reason = out_of_date_reason(
+            state.get(key), code, _paths(command_args, self.inputs),
+            _paths(command_args, self.outputs), input_states)
+        if reason is None and self.force:
+            reason = 'forced'
+
+        if self.dry_run:
+            self.stream.write('{0}: {1}\n'.format(
+                self.name, 'up to date' if reason is None
+                else 'would run, ' + reason))
+            return None
+        if reason is None:
+            if input_states != state[key]['inputs']:
+                # Touched inputs, which need not be hashed again.
+                state[key]['inputs'] = input_states
+                save_cache(self.state_path, STATE_KEY, state)
+            return None
+
+        ret = self.command(**command_args)
+        # Input states from before the run, so that inputs changed while it
+        # ran are seen as changed next time.
+        state = load_cache(self.state_path, STATE_KEY) or {}
+        state[key] = {'code': code, 'inputs': input_states}
+        save_cache(self.state_path, STATE_KEY, state)
+        return ret
+
+
+def out_of_date_reason(record, code, inputs, outputs, input_states):
+    '''Why a command with the given record from its last run is out of
+    date, or None if it is up to date
+
+    The current (mtime, size, sha1) of each input path is put in
+    input_states.'''
+    reason = None
+    if record is None:
+        reason = 'not run before'
+    elif record['code'] != code:
+        reason = 'command changed'
+    for path in outputs:
+        if reason is None and not os.path.exists(path):
+            reason = 'output {0} missing'.format(path)
+
+    recorded_states = record['inputs'] if record else {}
+    for path in inputs:
+        recorded = recorded_states.get(path)
+        current = file_state(path, recorded)
+        input_states[path] = current
+        if reason is not None:
+            continue
+        if current is None:
+            reason = 'input {0} missing'.format(path)
+        elif recorded is None or current[2] != recorded[2]:
+            reason = 'input {0} changed'.format(path)
+    return reason
+
+
+def file_state(path, recorded=None):
+    '''(mtime, size, sha1) of path, or None if it is missing
+
+    The file is only read if its mtime or size differ from recorded, its
+    previous state.'''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if recorded is not None and (stat.st_mtime, stat.st_size) ==\
+            tuple(recorded[:2]):
+        return recorded
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return stat.st_mtime, stat.st_size, sha.hexdigest()
+
+
+def _paths(command_args, varnames):
+    '''Absolute paths given as the arguments varnames'''
+    paths = []
+    for varname in varnames:
+        value = command_args[varname]
+        if value is None:
+            continue
+        for path in value if isinstance(value, (list, tuple)) else [value]:
+            paths.append(os.path.abspath(path))
+    return paths
@@ -0,0 +1,195 @@
+'''Running commands over chunks of large files in parallel
+
+A command decorated with e.g.
+@command(map_reduce=MapReduce('path', reduce=operator.add)) is the map
+function of a map-reduce over the file given as its path argument::
+
+    @command(map_reduce=MapReduce('path', reduce=operator.add))
+    def count_errors(path, pattern='ERROR'):
+        return sum(1 for line in path if pattern.encode() in line)
+
+The file is split into chunks of about chunk_size bytes, ending on record
+boundaries (lines by default), and the command is called for each chunk,
+with the argument set to a Chunk instead of the path. The chunks are
+processed by a pool of jobs worker processes, forked from the process that
+built the parser, so the command's other arguments and its results must be
+picklable. The results, in the order of the chunks, are combined with
+functools.reduce(reduce, results) and returned from dispatch_commands().
+'''
+import functools
+import os
+import sys
+
+try:
+    from .cache import function_fingerprint
+except (ImportError, ValueError):
+    # Imported as a top level module, see commandify.commandify.
+    from cache import function_fingerprint
+
+# The command run by worker processes, inherited when they are forked.
+_worker_command = None
+
+_READ_SIZE = 1 << 16
+
+
+class MapReduce(object):
+    '''Options for running a command over chunks of the file given as its
+    argument input
+
+    reduce combines two results. jobs defaults to the number of CPUs.
+    Records end with separator.'''
+    def __init__(self, input, reduce, jobs=None, chunk_size=32 << 20,
+                 separator=b'\n'):
+        self.input = input
+        self.reduce = reduce
+        self.jobs = jobs or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.separator = separator
+
+    def __repr__(self):
+        return 'MapReduce({0!r}, {1!r}, {2!r}, {3!r}, {4!r})'.format(
+            self.input, self.reduce, self.jobs, self.chunk_size,
+            self.separator)
+
+
+class Chunk(object):
+    '''Bytes start to end of the file at path, which end with separator
+    (unless at the end of the file)
+
+    Iterating over a chunk gives its records, including their separators.
+    '''
+    __slots__ = ('path', 'start', 'end', 'separator')
+
+    def __init__(self, path, start, end, separator=b'\n'):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.separator = separator
+
+    def read(self):
+        '''The chunk's bytes'''
+        with open(self.path, 'rb') as f:
+            f.seek(self.start)
+            return f.read(self.end - self.start)
+
+    def __iter__(self):
+        if self.separator == b'\n':
+            # Lines can be read without reading the whole chunk.
+            with open(self.path, 'rb') as f:
+                f.seek(self.start)
+                position = self.start
+                while position < self.end:
+                    line = f.readline()
+                    if not line:
+                        break
+                    position += len(line)
+                    yield line
+            return
+        records = self.read().split(self.separator)
+        for record in records[:-1]:
+            yield record + self.separator
+        if records[-1]:
+            yield records[-1]
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return 'Chunk({0!r}, {1}, {2})'.format(self.path, self.start,
+                                               self.end)
+
+
+def chunk_ranges(path, chunk_size, separator=b'\n'):
+    '''(start, end) of each chunk of the file at path
+
+    Each chunk ends after the first separator at least chunk_size bytes
+    after its start. An empty file has one empty chunk.'''
+    size = os.path.getsize(path)
+    ranges = []
+    start = 0
+    with open(path, 'rb') as f:
+        while start < size or not ranges:
+            end = start + chunk_size
+            if end >= size:
+                end = size
+            else:
+                end = _record_end(f, max(start, end - len(separator)),
+                                  separator, size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _record_end(f, position, separator, size):
+    '''Position after the first separator at or after position'''
+    f.seek(position)
+    searched = b''
+    while True:
+        data = f.read(_READ_SIZE)
+        if not data:
+            return size
+        # Keep enough of what was searched for a separator spanning reads.
+        dropped = max(0, len(searched) - (len(separator) - 1))
+        position += dropped
+        searched = searched[dropped:] + data
+        index = searched.find(separator)
+        if index != -1:
+            return position + index + len(separator)
+
+
+class MapReduceCommand(object):
+    '''Stands in for a map_reduce command, running it over chunks of its
+    input file and reducing the results'''
+    def __init__(self, name, command, map_reduce, timed):
+        self.name = name
+        self.command = command
+        self.map_reduce = map_reduce
+        self.timed = timed
+
+    def commandify_fingerprint(self):
+        return (function_fingerprint(self.command) +
+                repr(self.map_reduce).encode('utf-8'))
+
+    def __call__(self, **command_args):
+        map_reduce = self.map_reduce
+        path = command_args[map_reduce.input]
+        chunk_args = []
+        for start, end in chunk_ranges(path, map_reduce.chunk_size,
+                                       map_reduce.separator):
+            chunk_args.append(dict(command_args, **{
+                map_reduce.input: Chunk(path, start, end,
+                                        map_reduce.separator)}))
+        with self.timed('map', self.name):
+            results = self._map(chunk_args)
+        with self.timed('reduce', self.name):
+            return functools.reduce(map_reduce.reduce, results)
+
+    def _map(self, chunk_args):
+        '''The command's result for each of chunk_args'''
+        jobs = min(self.map_reduce.jobs, len(chunk_args))
+        if jobs > 1:
+            import multiprocessing
+            if 'fork' in multiprocessing.get_all_start_methods():
+                return self._map_in_pool(chunk_args, jobs)
+            # Workers could not inherit the command.
+            sys.stderr.write('warning: cannot fork, running {0} in one '
+                             'process\n'.format(self.name))
+        return [self.command(**command_args) for command_args in chunk_args]
+
+    def _map_in_pool(self, chunk_args, jobs):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        global _worker_command
+        _worker_command = self.command
+        executor = ProcessPoolExecutor(
+            jobs, mp_context=multiprocessing.get_context('fork'))
+        try:
+            return list(executor.map(_map_chunk, chunk_args))
+        finally:
+            executor.shutdown()
+            _worker_command = None
+
+
+def _map_chunk(command_args):
+    return _worker_command(**command_args)
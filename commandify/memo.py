@@ -0,0 +1,187 @@
+'''Memoizing command results on disk
+
+Commands decorated with e.g. @command(cache=True) are only called if their
+result for the arguments they are given is not already cached. Results are
+keyed on the command's code and its arguments (including any args
+Namespace and provide_args), so cached commands should be pure functions
+of these. Arguments or results that cannot be pickled are not cached.
+
+cache=True stores results in CACHE_DIR/PROG.results, where CACHE_DIR is the
+parser's cache_dir. To choose the directory or limit the cache's size, pass
+a ResultCache instead, which can be shared by several commands::
+
+    reports = ResultCache('~/.cache/tool', max_entries=100, ttl=3600)
+
+    @command(cache=reports)
+    def report(month):
+        ...
+'''
+import hashlib
+import os
+import pickle
+import time
+
+try:
+    from .cache import function_fingerprint, load_cache, save_cache
+except (ImportError, ValueError):
+    # Imported as a top level module, see commandify.commandify.
+    from cache import function_fingerprint, load_cache, save_cache
+
+_SUFFIX = '.result'
+
+# Hits, misses and evictions are counted in this file in the directory, so
+# that stats() covers every run.
+_STATS_NAME = 'stats'
+_STATS_KEY = 'result-cache-stats-1'
+_COUNTERS = ['hits', 'misses', 'evictions']
+
+
+class ResultCache(object):
+    '''Command results stored in directory, one file per result
+
+    Results older than ttl seconds are expired. When there are more than
+    max_entries results, or they take more than max_bytes, the least
+    recently used are evicted. The hits, misses and evictions since the
+    ResultCache was made are counted, and their totals for the directory
+    are kept on disk, see stats().'''
+    def __init__(self, directory, max_entries=1000, max_bytes=None,
+                 ttl=None):
+        self.directory = os.path.expanduser(directory)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, command, command_args):
+        '''Key for the result of command(**command_args), or None if the
+        arguments cannot be pickled'''
+        try:
+            args_bytes = pickle.dumps(sorted(command_args.items()), 2)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return None
+        sha = hashlib.sha1(function_fingerprint(command))
+        sha.update(args_bytes)
+        return sha.hexdigest()
+
+    def get(self, key):
+        '''(True, result) if a result is cached for key, else (False, None)
+        '''
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stat = None
+        if stat is not None and self._expired(stat, time.time()):
+            if self._remove(path):
+                self._count('evictions')
+            stat = None
+        cached = None if stat is None else load_cache(path, key)
+        if cached is None:
+            self._count('misses')
+            return False, None
+
+        self._count('hits')
+        try:
+            # Record the use for LRU eviction, keeping the time stored.
+            os.utime(path, (time.time(), stat.st_mtime))
+        except OSError:
+            pass
+        return True, cached[0]
+
+    def put(self, key, result):
+        '''Store result for key, evicting old results if the cache is full
+
+        Returns False if the result could not be stored.'''
+        # Stored in a tuple, as load_cache(...) returns None when missing.
+        if not save_cache(self._path(key), key, (result,)):
+            return False
+        if self.max_entries is not None or self.max_bytes is not None:
+            self.evict()
+        return True
+
+    def evict(self):
+        '''Remove expired results, then the least recently used results
+        until within max_entries and max_bytes'''
+        now = time.time()
+        entries = []
+        evictions = 0
+        for path, stat in self._entries():
+            if self._expired(stat, now):
+                evictions += self._remove(path)
+            else:
+                entries.append((stat.st_atime, stat.st_size, path))
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+        while entries and (
+                (self.max_entries is not None and
+                 len(entries) > self.max_entries) or
+                (self.max_bytes is not None and
+                 total_bytes > self.max_bytes)):
+            _, size, path = entries.pop(0)
+            evictions += self._remove(path)
+            total_bytes -= size
+        if evictions:
+            self._count('evictions', evictions)
+
+    def clear(self):
+        '''Remove all cached results'''
+        for path, _ in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        '''Dict of the hits, misses and evictions counted in directory by
+        every ResultCache using it, and the number of entries and bytes
+        cached'''
+        stats = self._load_counts()
+        sizes = [stat.st_size for _, stat in self._entries()]
+        stats.update(entries=len(sizes), bytes=sum(sizes))
+        return stats
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    def _load_counts(self):
+        counts = load_cache(os.path.join(self.directory, _STATS_NAME),
+                            _STATS_KEY)
+        return counts or dict((counter, 0) for counter in _COUNTERS)
+
+    def _count(self, counter, n=1):
+        '''Add n to counter, both in memory and on disk'''
+        setattr(self, counter, getattr(self, counter) + n)
+        counts = self._load_counts()
+        counts[counter] += n
+        # Concurrent runs may lose counts, which is fine for statistics.
+        save_cache(os.path.join(self.directory, _STATS_NAME), _STATS_KEY,
+                   counts)
+
+    def _expired(self, stat, now):
+        return self.ttl is not None and now - stat.st_mtime > self.ttl
+
+    def _entries(self):
+        '''(path, os.stat result) of each cached result'''
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith(_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                yield path, os.stat(path)
+            except OSError:
+                # Removed by another process.
+                pass
+
+    def _remove(self, path):
+        '''Remove a result, returning whether it was removed'''
+        try:
+            os.remove(path)
+        except OSError:
+            return False
+        return True
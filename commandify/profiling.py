@@ -0,0 +1,98 @@
+'''Profiling the dispatched commands, without argument parsing etc.
+
+Running a commandify script with --commandify-profile DIR (or passing
+profile_dir to CommandifyArgumentParser) profiles the main command and the
+sub command separately, writing DIR/PROG.COMMAND.collapsed for each. These
+are collapsed stacks, one "outer;...;inner count" line per stack, which can
+be turned into a flamegraph by e.g. flamegraph.pl or speedscope.
+
+Stacks are sampled when the process has used another interval seconds of
+CPU time, so time spent sleeping or waiting for I/O is not seen. Where
+sampling is not possible (no SIGPROF, e.g. on Windows, or not in the main
+thread), or with profiler='cprofile', cProfile is used instead, writing
+DIR/PROG.COMMAND.pstats to be read with pstats or e.g. snakeviz.
+'''
+import os
+import signal
+import threading
+from collections import Counter
+
+PROFILERS = ['sample', 'cprofile']
+
+
+class Sampler(object):
+    '''Signal based stack sampler'''
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.stacks = Counter()
+
+    @staticmethod
+    def available():
+        '''Whether stacks can be sampled here'''
+        return (hasattr(signal, 'setitimer') and hasattr(signal, 'SIGPROF')
+                and threading.current_thread() is threading.main_thread())
+
+    def run(self, func, kwargs):
+        '''Call func(**kwargs), sampling its stack'''
+        old_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        try:
+            return func(**kwargs)
+        finally:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, old_handler)
+
+    def _sample(self, signum, frame):
+        stack = []
+        # Stop at run(...), so only func and what it calls are included.
+        while frame is not None and frame.f_code is not _RUN_CODE:
+            stack.append(_frame_label(frame))
+            frame = frame.f_back
+        if stack:
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        '''Collapsed stack lines, as used by flamegraph.pl'''
+        return ['{0} {1}'.format(stack, count)
+                for stack, count in sorted(self.stacks.items())]
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for line in self.collapsed():
+                f.write(line + '\n')
+
+
+_RUN_CODE = Sampler.run.__code__
+
+
+def _frame_label(frame):
+    module_name = frame.f_globals.get('__name__', '?')
+    return '{0}:{1}'.format(module_name, frame.f_code.co_name)
+
+
+def profile_call(func, kwargs, path_prefix, profiler='sample',
+                 interval=0.001):
+    '''Call func(**kwargs) under profiler, returning its return value
+
+    The profile is written to path_prefix + '.collapsed', or '.pstats' if
+    cProfile is used.'''
+    if profiler not in PROFILERS:
+        raise ValueError('Unrecognised profiler {0}, expected one of: {1}'
+                         .format(profiler, ', '.join(PROFILERS)))
+    dirname = os.path.dirname(path_prefix)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+
+    if profiler == 'sample' and Sampler.available():
+        sampler = Sampler(interval)
+        try:
+            return sampler.run(func, kwargs)
+        finally:
+            sampler.write(path_prefix + '.collapsed')
+
+    import cProfile
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(func, **kwargs)
+    finally:
+        profile.dump_stats(path_prefix + '.pstats')
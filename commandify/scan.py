@@ -0,0 +1,181 @@
+'''Registering commands by scanning module source, without importing it
+
+Function names, argument names, literal defaults, docstrings and
+@command(...) options are all visible in the source, which is enough for
+help and completion. The modules are only imported when a command is
+dispatched.'''
+import ast
+import importlib
+
+from .commandify import LazyCommand, _commands, _main_commands
+from .commandify import _store_command_options
+
+# Names that may appear in decorator options, e.g. {'type': int}.
+_STATIC_NAMES = {
+    'int': int,
+    'float': float,
+    'str': str,
+    'bool': bool,
+    'complex': complex,
+}
+
+
+# The commandify decorators, and the modules they can be imported from.
+_DECORATORS = {'command': _commands, 'main_command': _main_commands}
+_COMMANDIFY_MODULES = ['commandify', 'commandify.commandify']
+
+# Returned by _decorator_container(...) for commands registered through
+# another object, e.g. a CommandRegistry.
+_OTHER_REGISTRY = object()
+
+
+class _NotStatic(Exception):
+    '''Raised when a value cannot be determined from the source alone'''
+    pass
+
+
+def scan_commands(*module_names):
+    '''Register the commands in each module by scanning its source
+
+    Commands whose arguments or options cannot be determined statically
+    (e.g. a default that is a function call) are registered so that their
+    module is imported when they are needed. Modules registering commands
+    through other objects, e.g. with @registry.command where registry is a
+    CommandRegistry, are imported.'''
+    for module_name in module_names:
+        for container, name, entry in scan_module(module_name):
+            container[name] = entry
+
+
+def scan_module(module_name):
+    '''Return (container, name, (command, dec_args, dec_kwargs)) for each
+    decorated function in the module
+
+    If the module registers commands through other objects it is imported
+    instead, registering them, and nothing is returned.'''
+    from importlib.util import find_spec
+    module_spec = find_spec(module_name)
+    if module_spec is None or not module_spec.has_location:
+        raise ImportError('No source found for module {0}'
+                          .format(module_name))
+    with open(module_spec.origin, 'rb') as f:
+        tree = ast.parse(f.read(), module_spec.origin)
+
+    decorators, modules, imported = _imported_names(tree)
+    decorated = []
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        for decorator in node.decorator_list:
+            container = _decorator_container(decorator, decorators, modules,
+                                             imported)
+            if container is _OTHER_REGISTRY:
+                importlib.import_module(module_name)
+                return []
+            if container is not None:
+                decorated.append((node, decorator, container))
+
+    entries = []
+    for node, decorator, container in decorated:
+        target = '{0}:{1}'.format(module_name, node.name)
+        doc = ast.get_docstring(node, clean=False)
+        if doc is None:
+            # No docstring, so there is no help to show.
+            doc = ''
+        try:
+            command, dec_args, dec_kwargs = _static_command(
+                target, doc, node, decorator)
+        except _NotStatic:
+            command = LazyCommand(target, doc=doc)
+            dec_args, dec_kwargs = [], {}
+        entries.append((container, node.name,
+                        (command, dec_args, dec_kwargs)))
+    return entries
+
+
+def _imported_names(tree):
+    '''(decorators, modules, imported): the names the module's imports bind
+    to commandify's decorators (mapped to the decorator's name), to
+    commandify itself, and to anything'''
+    decorators = {}
+    modules = set()
+    imported = set()
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                name = alias.asname or alias.name.split('.')[0]
+                imported.add(name)
+                if (alias.name if alias.asname else name) in\
+                        _COMMANDIFY_MODULES:
+                    modules.add(name)
+        elif isinstance(node, ast.ImportFrom):
+            from_commandify = (node.level == 0 and
+                               node.module in _COMMANDIFY_MODULES)
+            for alias in node.names:
+                if alias.name == '*':
+                    if from_commandify:
+                        decorators.update((name, name)
+                                          for name in _DECORATORS)
+                        imported.update(_DECORATORS)
+                    continue
+                name = alias.asname or alias.name
+                imported.add(name)
+                if from_commandify and alias.name in _DECORATORS:
+                    decorators[name] = alias.name
+    return decorators, modules, imported
+
+
+def _decorator_container(decorator, decorators, modules, imported):
+    '''Registry container for commandify's @command/@main_command
+    decorators, None for other decorators, or _OTHER_REGISTRY for those of
+    other objects, e.g. @registry.command where registry is a
+    CommandRegistry'''
+    if isinstance(decorator, ast.Call):
+        decorator = decorator.func
+    if isinstance(decorator, ast.Name):
+        return _DECORATORS.get(decorators.get(decorator.id))
+    if (not isinstance(decorator, ast.Attribute) or
+            decorator.attr not in _DECORATORS):
+        return None
+    if isinstance(decorator.value, ast.Name):
+        if decorator.value.id in modules:
+            return _DECORATORS[decorator.attr]
+        if decorator.value.id in imported:
+            # E.g. @click.command, not a commandify decorator.
+            return None
+    return _OTHER_REGISTRY
+
+
+def _static_command(target, doc, node, decorator):
+    if isinstance(decorator, ast.Call):
+        if decorator.args:
+            raise _NotStatic()
+        dec_kwargs = dict((keyword.arg, _static_value(keyword.value))
+                          for keyword in decorator.keywords)
+    else:
+        dec_kwargs = {}
+
+    arguments = getattr(node.args, 'posonlyargs', []) + node.args.args
+    argument_names = tuple(argument.arg for argument in arguments)
+    defaults = tuple(_static_value(default)
+                     for default in node.args.defaults) or None
+    command = LazyCommand(target, doc=doc,
+                          signature=(argument_names, defaults))
+    # E.g. cache=True, as @command(...) would store it.
+    return command, (), _store_command_options(command, dec_kwargs)
+
+
+def _static_value(node):
+    '''Evaluate a literal, allowing builtin types such as int'''
+    if isinstance(node, ast.Name) and node.id in _STATIC_NAMES:
+        return _STATIC_NAMES[node.id]
+    if isinstance(node, ast.Dict):
+        if None in node.keys:
+            # Dict unpacking, e.g. {**options}.
+            raise _NotStatic()
+        return dict((_static_value(key), _static_value(value))
+                    for key, value in zip(node.keys, node.values))
+    try:
+        return ast.literal_eval(node)
+    except (ValueError, TypeError, SyntaxError):
+        raise _NotStatic()
@@ -0,0 +1,74 @@
+'''Timing commandify's own phases, e.g. setting up and parsing arguments
+
+Enabled by running a commandify script with --commandify-timings, which
+prints a table to stderr, or --commandify-timings=FILE, which writes JSON.
+'''
+import json
+import time
+
+
+class Timings(object):
+    '''Records how long each phase takes, optionally per command
+
+    Phases can be nested, e.g. per command spec derivation within
+    setup_arguments.'''
+    def __init__(self):
+        self.records = []
+        self._depth = 0
+
+    def time(self, phase, command=None):
+        '''Context manager that records the time taken by its body'''
+        return _Timer(self, phase, command)
+
+    def add(self, phase, command, seconds, depth=0):
+        self.records.append((phase, command, seconds, depth))
+
+    def as_dicts(self):
+        return [{'phase': phase, 'command': command, 'seconds': seconds,
+                 'depth': depth}
+                for phase, command, seconds, depth in self.records]
+
+    def to_json(self):
+        return json.dumps(self.as_dicts(), indent=2)
+
+    def table(self):
+        '''Table of all records in the order their phases started'''
+        rows = [('phase', 'command', 'ms')]
+        for phase, command, seconds, depth in self.records:
+            rows.append(('  ' * depth + phase, command or '',
+                         '{0:.3f}'.format(seconds * 1000)))
+        widths = [max(len(row[i]) for row in rows) for i in range(3)]
+        return '\n'.join('{0:<{3}}  {1:<{4}}  {2:>{5}}'
+                         .format(*(row + tuple(widths)))
+                         for row in rows)
+
+    def write(self, destination, stream):
+        '''Write JSON to the file destination, or a table to stream if
+        destination is True'''
+        if destination is True:
+            stream.write(self.table() + '\n')
+        else:
+            with open(destination, 'w') as f:
+                f.write(self.to_json())
+
+
+class _Timer(object):
+    def __init__(self, timings, phase, command):
+        self.timings = timings
+        self.phase = phase
+        self.command = command
+
+    def __enter__(self):
+        # Reserve a slot so that records are in the order phases start.
+        self.index = len(self.timings.records)
+        self.depth = self.timings._depth
+        self.timings.records.append(None)
+        self.timings._depth += 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        seconds = time.perf_counter() - self.start
+        self.timings._depth -= 1
+        self.timings.records[self.index] = (self.phase, self.command,
+                                            seconds, self.depth)
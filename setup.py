@@ -22,7 +22,8 @@ setup(
     maintainer='Mark Muetzelfeldt',
     maintainer_email='markmuetz@gmail.com',
     packages=['commandify'],
-    scripts=['commandify/commandify_examples'],
+    scripts=['commandify/commandify_examples',
+             'commandify/commandify_client'],
     url='https://github.com/markmuetz/commandify',
     test_suite='nose.collector',
     tests_require=['nose'],
@@ -0,0 +1,258 @@
+'''Benchmarks for building, parsing and dispatching large command registries
+
+Synthetic registries of 1 to 10,000 commands, each with 0-50 arguments,
+are timed through setup_arguments(), parse_args() (also with fast_parse),
+dispatch_commands() and a full commandify() call. Run from the top level
+project directory::
+
+    python tests/benchmarks/bench_commandify.py
+    python tests/benchmarks/bench_commandify.py --sizes 1 100 --check
+
+Results are compared with tests/benchmarks/baselines.json, which is
+updated by passing --save-baseline. Timings vary between machines, so save
+a baseline on the machine used for comparisons before making changes.
+'''
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+import commandify as cmdify  # noqa: E402
+
+SIZES = [1, 100, 1000, 10000]
+BENCHMARKS = ['setup_arguments', 'parse_args', 'parse_args_fast',
+              'dispatch_commands', 'commandify']
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baselines.json')
+MAX_ARGUMENTS = 50
+PROVIDE_ARGS = {'context': object()}
+
+
+def make_registry(num_commands, seed=0):
+    '''Register a main command and num_commands synthetic sub commands
+
+    Returns argv that invokes the last sub command with all of its required
+    arguments and some of its optional ones. Arguments cycle through
+    required values, typed defaults, false and true bool defaults (--not-)
+    and defaults given to the decorator; some commands also take args and a
+    provided argument, and the first argument has a short flag.'''
+    cmdify._main_commands.clear()
+    cmdify._commands.clear()
+    rand = random.Random(seed)
+
+    @cmdify.main_command(verbose={'flag': '-v'})
+    def main(verbose=False):
+        return verbose
+
+    argv = []
+    for i in range(num_commands):
+        name = 'cmd_{0}'.format(i)
+        # Arguments without defaults in the signature must come first.
+        params, default_params, dec_kwargs, argv = [], [], {}, [name]
+        if i % 3 == 0:
+            params.append('args')
+        if i % 5 == 0:
+            params.append('context')
+        for j in range(rand.randint(0, MAX_ARGUMENTS)):
+            varname = 'arg_{0}'.format(j)
+            kind = j % 5
+            if kind == 0:
+                params.append(varname)
+                argv += ['--arg-{0}'.format(j), 'value']
+            elif kind == 1:
+                default_params.append('{0}={1}'.format(varname, j))
+                argv += ['--arg-{0}'.format(j), str(j + 1)]
+            elif kind == 2:
+                default_params.append('{0}=False'.format(varname))
+                argv.append('--arg-{0}'.format(j))
+            elif kind == 3:
+                default_params.append('{0}=True'.format(varname))
+            else:
+                params.append(varname)
+                dec_kwargs[varname] = {'default': 'decorated'}
+            if j == 0:
+                dec_kwargs.setdefault(varname, {})['flag'] = '-a'
+        params += default_params
+        namespace = {}
+        exec('def {0}({1}):\n    return {2}\n'.format(
+            name, ', '.join(params), len(params)), namespace)
+        cmdify.command(**dec_kwargs)(namespace[name])
+    return argv
+
+
+def _parser(**kwargs):
+    return cmdify.CommandifyArgumentParser(prog='bench',
+                                           provide_args=PROVIDE_ARGS,
+                                           suppress_warnings=['default_true'],
+                                           **kwargs)
+
+
+def _time(func, setup=None, min_time=0.05, repeat=5):
+    '''Fastest seconds per call of func(), over at least repeat runs
+
+    The fastest run is the least affected by other activity on the machine,
+    and garbage collection is disabled while timing.
+    If setup is given, it is called (untimed) before each call of func, and
+    func is called until it has taken min_time in total. Otherwise each run
+    calls func enough times to take at least min_time. Slow (over a second)
+    benchmarks are only run 3 times.'''
+    runs = []
+    number = 1
+    while len(runs) < repeat or (setup is not None and sum(runs) < min_time):
+        if setup is not None:
+            setup()
+        # As timeit, keep garbage collection out of the timings.
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        if setup is None and elapsed < min_time and not runs:
+            number *= 2
+            continue
+        runs.append(elapsed / number)
+        if elapsed > 1:
+            repeat = min(repeat, 3)
+    return min(runs)
+
+
+def bench_setup_arguments(size):
+    make_registry(size)
+    parsers = []
+
+    def setup():
+        parsers[:] = [_parser()]
+    return _time(lambda: parsers[0].setup_arguments(), setup)
+
+
+def bench_parse_args(size):
+    argv = make_registry(size)
+    parser = _parser()
+    parser.setup_arguments()
+    return _time(lambda: parser.parse_args(argv))
+
+
+def bench_parse_args_fast(size):
+    argv = make_registry(size)
+    parser = _parser(fast_parse=True)
+    parser.setup_arguments()
+    return _time(lambda: parser.parse_args(argv))
+
+
+def bench_dispatch_commands(size):
+    argv = make_registry(size)
+    parser = _parser()
+    parser.setup_arguments()
+    parser.parse_args(argv)
+    return _time(lambda: parser.dispatch_commands())
+
+
+def bench_commandify(size):
+    argv = make_registry(size)
+
+    def run():
+        old_argv = sys.argv
+        sys.argv = ['bench'] + argv
+        try:
+            cmdify.commandify(exit=False, provide_args=PROVIDE_ARGS,
+                              suppress_warnings=['default_true'])
+        finally:
+            sys.argv = old_argv
+    return _time(run)
+
+
+def run_benchmarks(sizes, benchmarks=BENCHMARKS):
+    '''Dict of 'benchmark/size' to seconds per call'''
+    results = {}
+    for size in sizes:
+        for benchmark in benchmarks:
+            key = '{0}/{1}'.format(benchmark, size)
+            results[key] = globals()['bench_' + benchmark](size)
+            sys.stderr.write('{0}: {1:.3f} ms\n'
+                             .format(key, results[key] * 1000))
+    return results
+
+
+def load_baseline(path=BASELINE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    baseline = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': dict(load_baseline(path), **results),
+    }
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def compare(results, baseline, threshold):
+    '''Report lines comparing results with baseline, and the regressions
+
+    A benchmark has regressed if it is more than threshold (a fraction)
+    slower than its baseline.'''
+    lines = ['{0:<26} {1:>12} {2:>12} {3:>7}'.format(
+        'benchmark', 'ms', 'baseline ms', 'ratio')]
+    regressions = []
+    for key in sorted(results, key=_sort_key):
+        if key in baseline:
+            ratio = results[key] / baseline[key]
+            baseline_ms = '{0:.3f}'.format(baseline[key] * 1000)
+            ratio_str = '{0:.2f}'.format(ratio)
+            if ratio > 1 + threshold:
+                regressions.append(key)
+                ratio_str += ' !'
+        else:
+            baseline_ms, ratio_str = '-', '-'
+        lines.append('{0:<26} {1:>12.3f} {2:>12} {3:>7}'.format(
+            key, results[key] * 1000, baseline_ms, ratio_str))
+    return lines, regressions
+
+
+def _sort_key(key):
+    benchmark, size = key.split('/')
+    return int(size), BENCHMARKS.index(benchmark)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS,
+                        default=BENCHMARKS)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store these results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='fraction slower than baseline that is a '
+                        'regression (default 0.25)')
+    parser.add_argument('--check', action='store_true',
+                        help='exit with status 1 if any benchmark regressed')
+    options = parser.parse_args(argv)
+
+    results = run_benchmarks(options.sizes, options.benchmarks)
+    lines, regressions = compare(results, load_baseline(options.baseline),
+                                 options.threshold)
+    print('\n'.join(lines))
+    if regressions:
+        print('Regressed by more than {0:.0%}: {1}'.format(
+            options.threshold, ', '.join(regressions)))
+    if options.save_baseline:
+        save_baseline(results, options.baseline)
+    return 1 if options.check and regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
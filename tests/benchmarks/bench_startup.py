@@ -0,0 +1,164 @@
+'''Cold start benchmarks: wall clock time of running commands in new processes
+
+By default, commandify_examples is run with cmd_no_args, cmd3 and --help.
+Any other script can be benchmarked by giving its command lines. Run from
+the top level project directory::
+
+    python tests/benchmarks/bench_startup.py
+    python tests/benchmarks/bench_startup.py --command 'mytool.py cmd --a 1'
+
+Each command line is run --runs times, reporting the min, median and 95th
+percentile times, and once with python -X importtime to show the slowest
+imports. Exits with status 1 if any median time is more than --threshold
+slower than in tests/benchmarks/startup_baselines.json, which is updated by
+passing --save-baseline. Save a baseline on the machine used for
+comparisons before making changes.
+'''
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+
+from bench_commandify import load_baseline, save_baseline
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..',
+                                           '..'))
+BASELINE_PATH = os.path.join(os.path.dirname(__file__),
+                             'startup_baselines.json')
+EXAMPLES = ['commandify_examples cmd_no_args',
+            'commandify_examples cmd3',
+            'commandify_examples --help']
+
+
+def python_command(command_line):
+    '''python argv for a command line, running commandify_examples as a
+    module of the package'''
+    argv = shlex.split(command_line)
+    if argv[0] == 'commandify_examples':
+        return [sys.executable, '-m', 'commandify.commandify_examples'] +\
+            argv[1:]
+    return [sys.executable] + argv
+
+
+def time_runs(argv, runs):
+    '''Sorted wall clock seconds for each of runs runs of argv'''
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        status = subprocess.call(argv, cwd=PROJECT_DIR,
+                                 stdout=subprocess.DEVNULL,
+                                 stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+        if status != 0:
+            raise RuntimeError('{0} exited with status {1}'
+                               .format(' '.join(argv), status))
+    return sorted(times)
+
+
+def percentile(sorted_values, fraction):
+    index = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def import_times(argv):
+    '''(module, self seconds, cumulative seconds) from -X importtime,
+    slowest cumulative first'''
+    process = subprocess.Popen(argv[:1] + ['-X', 'importtime'] + argv[1:],
+                               cwd=PROJECT_DIR, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE)
+    _, stderr = process.communicate()
+    imports = []
+    for line in stderr.decode().splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or '[us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):]\
+            .split('|')
+        imports.append((module.rstrip(), int(self_us) / 1e6,
+                        int(cumulative_us) / 1e6))
+    return sorted(imports, key=lambda record: -record[2])
+
+
+def run_benchmarks(command_lines, runs, top_imports):
+    '''Dict of command line to its timings, printing the slowest imports'''
+    results = {}
+    for command_line in command_lines:
+        argv = python_command(command_line)
+        times = time_runs(argv, runs)
+        imports = import_times(argv)
+        results[command_line] = {
+            'min': times[0],
+            'median': percentile(times, 0.5),
+            'p95': percentile(times, 0.95),
+            'imports': imports,
+        }
+        print('Slowest imports for {0}:'.format(command_line))
+        for module, self_seconds, cumulative in imports[:top_imports]:
+            print('  {0:>10.3f} ms {1:>10.3f} ms  {2}'.format(
+                cumulative * 1000, self_seconds * 1000, module))
+    return results
+
+
+def report(results, baseline, threshold):
+    '''Report lines and regressed command lines, comparing medians'''
+    lines = ['{0:<40} {1:>9} {2:>9} {3:>9} {4:>11} {5:>7}'.format(
+        'command', 'min ms', 'median ms', 'p95 ms', 'baseline ms', 'ratio')]
+    regressions = []
+    for command_line, result in results.items():
+        if command_line in baseline:
+            ratio = result['median'] / baseline[command_line]
+            baseline_ms = '{0:.1f}'.format(baseline[command_line] * 1000)
+            ratio_str = '{0:.2f}'.format(ratio)
+            if ratio > 1 + threshold:
+                regressions.append(command_line)
+                ratio_str += ' !'
+        else:
+            baseline_ms, ratio_str = '-', '-'
+        lines.append('{0:<40} {1:>9.1f} {2:>9.1f} {3:>9.1f} {4:>11} {5:>7}'
+                     .format(command_line, result['min'] * 1000,
+                             result['median'] * 1000, result['p95'] * 1000,
+                             baseline_ms, ratio_str))
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--command', action='append', dest='commands',
+                        help='command line to benchmark, script first '
+                        '(default: commandify_examples commands)')
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--top-imports', type=int, default=10,
+                        help='number of slowest imports to show')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store these median times as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='fraction slower than baseline that is a '
+                        'regression (default 0.2)')
+    parser.add_argument('--json', help='also write all results to this file')
+    options = parser.parse_args(argv)
+
+    results = run_benchmarks(options.commands or EXAMPLES, options.runs,
+                             options.top_imports)
+    lines, regressions = report(results, load_baseline(options.baseline),
+                                options.threshold)
+    print('\n'.join(lines))
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if options.save_baseline:
+        save_baseline(dict((command_line, result['median'])
+                           for command_line, result in results.items()),
+                      options.baseline)
+    elif regressions:
+        print('Startup regressed by more than {0:.0%}: {1}'.format(
+            options.threshold, ', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,21 @@
 # Borrows heavily from argparse tests.
 # Doesn't use meta class to setup tests.
+import asyncio
+import json
+import os
+import shutil
+import signal
+import stat
+import subprocess
 import sys
+import tempfile
+import time
 import unittest
 from collections import OrderedDict
 
 import commandify as cmdify
+from commandify import batch, completion, daemon, filetypes, mapreduce
+from commandify import cache as cache_module
 print(cmdify._main_commands)
 
 try:
@@ -452,3 +463,1386 @@ class TestCommandDispatch(BaseUnitTest):
 
         self._run_dispatch_tests(failures, successes)
         assert count == len(successes) + start_count
+
+
+class TestLazySubparsers(BaseUnitTest):
+    def setUp(self):
+        super(TestLazySubparsers, self).setUp()
+
+        @cmdify.main_command(main_arg={'flag': '-m'})
+        def m(main_arg=9, verbose=False):
+            return main_arg
+
+        @cmdify.command
+        def c1(some_arg='jo'):
+            return some_arg
+
+        @cmdify.command
+        def c2(other_arg=True):
+            return other_arg
+
+        @cmdify.command
+        def c3(args, value):
+            return value
+
+    def _build_parser(self, lazy):
+        parser = ErrorRaisingArgumentParser(
+            lazy=lazy, suppress_warnings=['default_true'])
+        parser.setup_arguments()
+        return parser
+
+    def test_1_same_results_as_eager(self):
+        argvs = ['c1', 'c1 --some-arg=bob', '--main-arg 3 c2',
+                 '-m 4 c2 --not-other-arg', '--verbose -m=5 c3 --value 1',
+                 '--verbose --main-arg=7 c1 --some-arg fred']
+        for argv in argvs:
+            eager = self._build_parser(lazy=False)
+            eager_ns = vars(eager.parse_args(argv.split())).copy()
+            eager_ret = eager.dispatch_commands()
+            lazy = self._build_parser(lazy=True)
+            assert vars(lazy.parse_args(argv.split())) == eager_ns
+            assert lazy.dispatch_commands() == eager_ret
+
+    def test_2_only_invoked_subparser_built(self):
+        parser = self._build_parser(lazy=True)
+        parser.parse_args(['-m', '3', 'c2'])
+        assert parser._built_commands == set(['c2'])
+
+    def test_3_help_and_errors_build_all(self):
+        for argv in ['--help', 'c4', 'c1 extra', '--main c1']:
+            errors = []
+            for lazy in [False, True]:
+                parser = self._build_parser(lazy)
+                try:
+                    parser.parse_args(argv.split())
+                except ArgumentParserError as e:
+                    errors.append((e.stdout, e.stderr))
+            assert len(errors) == 2
+            assert errors[0] == errors[1]
+
+
+class TestSpecCache(BaseUnitTest):
+    def setUp(self):
+        super(TestSpecCache, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _build_parser(self, default='jo', fail_on_introspection=False,
+                      annotation=str):
+        cmdify._main_commands.clear()
+        cmdify._commands.clear()
+
+        @cmdify.main_command(main_arg={'flag': '-m'})
+        def m(main_arg=9):
+            return main_arg
+
+        @cmdify.command
+        def c1(some_arg: annotation = default, other_arg=True):
+            return some_arg, other_arg
+
+        parser = ErrorRaisingArgumentParser(
+            cache_dir=self.cache_dir, suppress_warnings=['default_true'])
+        if fail_on_introspection:
+            def fail(*args):
+                raise AssertionError('spec not loaded from cache')
+            parser._command_spec = fail
+        parser.setup_arguments()
+        return parser
+
+    def test_1_warm_run_uses_cache(self):
+        cold = self._build_parser()
+        assert os.listdir(self.cache_dir)
+        warm = self._build_parser(fail_on_introspection=True)
+        argv = ['-m', '3', 'c1', '--some-arg=x', '--not-other-arg']
+        assert cold.parse_args(argv) == warm.parse_args(argv)
+        assert warm.dispatch_commands() == (3, ('x', False))
+
+    def test_2_changed_command_invalidates_cache(self):
+        self._build_parser()
+        parser = self._build_parser(default=5)
+        assert parser.parse_args(['c1']).some_arg == 5
+        self.assertRaises(AssertionError, self._build_parser, default=6,
+                          fail_on_introspection=True)
+
+    def test_3_changed_annotation_invalidates_cache(self):
+        self._build_parser()
+        parser = self._build_parser(annotation=memoryview)
+        args = parser.parse_args(['c1', '--some-arg', __file__])
+        assert isinstance(args.some_arg, memoryview)
+        self.assertRaises(AssertionError, self._build_parser,
+                          annotation=bytes, fail_on_introspection=True)
+
+    def test_4_same_key_in_every_process(self):
+        script = '\n'.join([
+            'import sys',
+            'import commandify as cmdify',
+            'from commandify.filetypes import mapped',
+            'def upper(value):',
+            '    return value.upper()',
+            '@cmdify.main_command(data={"type": mapped},',
+            '                     name={"type": upper})',
+            'def m(data, name="x"):',
+            '    pass',
+            'parser = cmdify.CommandifyArgumentParser(cache_dir=sys.argv[1])',
+            'parser.setup_arguments()',
+            'print(parser._cache_key)'])
+        keys = [subprocess.check_output(
+            [sys.executable, '-c', script, self.cache_dir]) for _ in range(2)]
+        assert keys[0] == keys[1]
+
+    def test_5_new_version_invalidates_cache(self):
+        self._build_parser()
+        old_version = cache_module.VERSION
+        cache_module.VERSION = old_version[:3] + (old_version[3] + 1,)
+        try:
+            self.assertRaises(AssertionError, self._build_parser,
+                              fail_on_introspection=True)
+        finally:
+            cache_module.VERSION = old_version
+
+
+LAZY_MODULE_SOURCE = """
+def {0}(value, repeat=2):
+    '''Repeat value
+    More details'''
+    return value * repeat
+"""
+
+
+class TestRegisterCommand(BaseUnitTest):
+    def setUp(self):
+        super(TestRegisterCommand, self).setUp()
+        self.module_dir = tempfile.mkdtemp()
+        sys.path.insert(0, self.module_dir)
+        for module_name in ['lazy_mod_a', 'lazy_mod_b']:
+            path = os.path.join(self.module_dir, module_name + '.py')
+            with open(path, 'w') as f:
+                f.write(LAZY_MODULE_SOURCE.format('func_' + module_name[-1]))
+
+        @cmdify.main_command
+        def m():
+            return None
+
+        cmdify.register_command('lazy_mod_a:func_a')
+        cmdify.register_command('lazy_mod_b:func_b', name='b',
+                                help='Repeat value')
+
+    def tearDown(self):
+        sys.path.remove(self.module_dir)
+        for module_name in ['lazy_mod_a', 'lazy_mod_b']:
+            sys.modules.pop(module_name, None)
+        shutil.rmtree(self.module_dir)
+
+    def test_1_only_dispatched_module_imported(self):
+        self.parser = ErrorRaisingArgumentParser(lazy=True)
+        self.parser.setup_arguments()
+        assert 'lazy_mod_a' not in sys.modules
+        self.parser.parse_args(['func_a', '--value', 'x'])
+        assert self.parser.dispatch_commands() == (None, 'xx')
+        assert 'lazy_mod_b' not in sys.modules
+
+    def test_2_help_without_import(self):
+        self.parser = ErrorRaisingArgumentParser(lazy=True)
+        self.parser.setup_arguments()
+        try:
+            self.parser.parse_args(['--help'])
+        except ArgumentParserError as e:
+            stdout = e.stdout
+        assert 'Repeat value' in stdout
+        assert 'lazy_mod_b' not in sys.modules
+
+    def test_3_eager(self):
+        self._run_dispatch_tests(
+            ['b', 'b --value'],
+            [('b --value=y --repeat 3',
+              NS(command='b', value='y', repeat=3), (None, 'yyy'))])
+
+    def test_4_docstrings(self):
+        assert cmdify.LazyCommand.__doc__.startswith('Stands in for a')
+        assert cmdify._commands['b'][0].__doc__ == 'Repeat value'
+        assert 'lazy_mod_b' not in sys.modules
+        assert cmdify._commands['func_a'][0].__doc__ ==\
+            'Repeat value\n    More details'
+
+    def test_5_required_commands_not_imported(self):
+        @cmdify.command
+        def fetch():
+            return 'f'
+
+        @cmdify.command(requires=['fetch'])
+        def index(args):
+            return args.required_ret['fetch'] + 'i'
+
+        self.parser = ErrorRaisingArgumentParser(lazy=True)
+        self.parser.setup_arguments()
+        assert self.parser.parse_and_dispatch(['index']) == (None, 'fi')
+        assert 'lazy_mod_a' not in sys.modules
+        assert 'lazy_mod_b' not in sys.modules
+
+
+SCANNED_MODULE_SOURCE = """
+import commandify as cmdify
+from commandify import command
+from commandify import command as aliased_command
+
+
+@cmdify.main_command(verbose={'flag': '-v'})
+def main(verbose=False):
+    '''Scanned main command'''
+    return verbose
+
+
+@command(count={'type': int, 'flag': '-c'})
+def scanned_cmd(args, name, count=1, scale=2.5):
+    '''Scanned command help
+    More details'''
+    return name * count, scale
+
+
+@command(value={'flag': '-d'})
+def dynamic_cmd(value=len('abc')):
+    return value
+
+
+@command
+async def async_cmd(args, value='v'):
+    return args.main_ret, value
+
+
+@aliased_command
+def aliased_cmd():
+    return None
+
+
+@command(cache=True, requires=['dynamic_cmd'], value={'flag': '-e'})
+def options_cmd(args, value=1):
+    return args.required_ret['dynamic_cmd'], value
+"""
+
+REGISTRY_MODULE_SOURCE = """
+import commandify as cmdify
+
+remote = cmdify.CommandRegistry()
+
+
+@remote.command
+def push(force=False):
+    return force
+"""
+
+
+class TestScanCommands(BaseUnitTest):
+    def setUp(self):
+        super(TestScanCommands, self).setUp()
+        self.module_dir = tempfile.mkdtemp()
+        sys.path.insert(0, self.module_dir)
+        with open(os.path.join(self.module_dir, 'scanned_mod.py'), 'w') as f:
+            f.write(SCANNED_MODULE_SOURCE)
+        with open(os.path.join(self.module_dir, 'registry_mod.py'),
+                  'w') as f:
+            f.write(REGISTRY_MODULE_SOURCE)
+        cmdify.scan_commands('scanned_mod')
+
+    def tearDown(self):
+        sys.path.remove(self.module_dir)
+        sys.modules.pop('scanned_mod', None)
+        sys.modules.pop('registry_mod', None)
+        shutil.rmtree(self.module_dir)
+
+    def test_1_signature_matches_source(self):
+        command = cmdify._commands['scanned_cmd'][0]
+        assert command.static
+        assert command.signature() == (('args', 'name', 'count', 'scale'),
+                                       (1, 2.5))
+        assert not cmdify._commands['dynamic_cmd'][0].static
+        assert 'scanned_mod' not in sys.modules
+
+    def test_2_help_and_parse_without_import(self):
+        self.parser = ErrorRaisingArgumentParser(lazy=True)
+        self.parser.setup_arguments()
+        try:
+            self.parser.parse_args(['--help'])
+        except ArgumentParserError as e:
+            stdout = e.stdout
+        assert 'Scanned command help' in stdout
+        args = self.parser.parse_args(['-v', 'scanned_cmd', '--name', 'a',
+                                       '-c', '2'])
+        assert args == NS(verbose=True, command='scanned_cmd', name='a',
+                          count=2, scale=2.5)
+        assert 'scanned_mod' not in sys.modules
+
+    def test_3_dispatch_imports(self):
+        self.parser = ErrorRaisingArgumentParser(lazy=True)
+        self.parser.setup_arguments()
+        self.parser.parse_args(['scanned_cmd', '--name', 'a', '-c', '3'])
+        assert self.parser.dispatch_commands() == (False, ('aaa', 2.5))
+        assert 'scanned_mod' in sys.modules
+
+    def test_4_dynamic_command_imported_for_options(self):
+        self.parser = ErrorRaisingArgumentParser(lazy=True)
+        self.parser.setup_arguments()
+        self.parser.parse_args(['dynamic_cmd', '-d', '5'])
+        assert self.parser.dispatch_commands() == (False, 5)
+
+    def test_5_command_options(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            self.parser = ErrorRaisingArgumentParser(lazy=True,
+                                                     cache_dir=cache_dir)
+            self.parser.setup_arguments()
+            assert self.parser.parse_and_dispatch(
+                ['options_cmd', '-e', '2']) == (False, (3, 2))
+            assert self.parser.result_cache.stats()['entries'] == 1
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_6_decorators_of_other_objects(self):
+        assert cmdify._commands['aliased_cmd'][0].static
+        cmdify.scan_commands('registry_mod')
+        # Imported, so registered with its own registry.
+        assert 'push' not in cmdify._commands
+        assert 'push' in sys.modules['registry_mod'].remote.commands
+
+    def test_7_async_command(self):
+        command = cmdify._commands['async_cmd'][0]
+        assert command.static
+        assert command.signature() == (('args', 'value'), ('v',))
+        self.parser = ErrorRaisingArgumentParser(lazy=True)
+        self.parser.setup_arguments()
+        self.parser.parse_args(['async_cmd', '--value', 'w'])
+        assert self.parser.dispatch_commands() == (False, (False, 'w'))
+
+
+class TestFastComplete(BaseUnitTest):
+    def setUp(self):
+        super(TestFastComplete, self).setUp()
+
+        @cmdify.main_command(main_arg={'flag': '-m'})
+        def m(main_arg=9, verbose=False):
+            return main_arg
+
+        @cmdify.command
+        def cmd_one(some_arg='jo', other_arg=True):
+            return some_arg
+
+        @cmdify.command
+        def cmd_two(value):
+            return value
+
+        self.cache_dir = tempfile.mkdtemp()
+        self.parser = ErrorRaisingArgumentParser(
+            prog='tool', cache_dir=self.cache_dir,
+            suppress_warnings=['default_true'])
+        self.parser.setup_arguments()
+        self.index = self.parser.completion_index()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _complete(self, line):
+        return completion.complete(self.index, line, len(line))
+
+    def test_1_complete(self):
+        assert self._complete('tool ') == ['cmd_one', 'cmd_two']
+        assert self._complete('tool cmd_t') == ['cmd_two']
+        assert self._complete('tool --m') == ['--main-arg']
+        assert self._complete('tool -m ') == []
+        assert self._complete('tool -m 3 --verbose cmd_o') == ['cmd_one']
+        assert self._complete('tool -m=3 cmd_one --') ==\
+            ['--help', '--some-arg', '--not-other-arg']
+        assert self._complete('tool cmd_one --some-arg ') == []
+        assert self._complete('tool cmd_two --v') == ['--value']
+
+    def test_2_fast_complete_from_saved_index(self):
+        cmdify.cache.save_cache(
+            os.path.join(self.cache_dir, 'tool.complete'),
+            cmdify.cache.COMPLETION_INDEX_KEY, self.index)
+        output_filename = os.path.join(self.cache_dir, 'output')
+        environ = {'_ARGCOMPLETE': '1', 'COMP_LINE': 'tool cmd_',
+                   'COMP_POINT': '9',
+                   '_ARGCOMPLETE_STDOUT_FILENAME': output_filename}
+        exit_codes = []
+        old_environ = os.environ.copy()
+        os.environ.update(environ)
+        try:
+            completion.fast_complete(self.cache_dir, prog='tool',
+                                     exit_method=exit_codes.append)
+        finally:
+            os.environ.clear()
+            os.environ.update(old_environ)
+        assert exit_codes == [0]
+        with open(output_filename) as f:
+            assert f.read() == 'cmd_one\x0bcmd_two'
+
+    def test_3_completion_scripts(self):
+        bash = completion.completion_script(self.index, 'bash', 'tool')
+        assert 'complete -o default -F _tool_complete tool' in bash
+        assert ('cmd_one) opts="-h --help --some-arg --not-other-arg"; '
+                'values="--some-arg";;') in bash
+        zsh = completion.completion_script(self.index, 'zsh', 'tool')
+        assert 'compdef _tool tool' in zsh
+        fish = completion.completion_script(self.index, 'fish', 'tool')
+        assert ('complete -c tool -n __fish_use_subcommand -l main-arg '
+                '-s m -r') in fish
+        self.assertRaises(ValueError, completion.completion_script,
+                          self.index, 'csh', 'tool')
+
+
+class TestBatch(BaseUnitTest):
+    def setUp(self):
+        super(TestBatch, self).setUp()
+
+        @cmdify.main_command
+        def m(main_arg=1):
+            return main_arg
+
+        @cmdify.command
+        def c(args, some_arg=True, value='v'):
+            assert not hasattr(args, 'not_some_arg')
+            if value == 'raise':
+                raise ValueError(value)
+            return args.main_ret, some_arg, value
+
+        self.parser = ErrorRaisingArgumentParser(
+            lazy=True, suppress_warnings=['default_true'])
+        self.parser.setup_arguments()
+
+    def test_1_run_batch(self):
+        lines = [
+            'c --not-some-arg --value "a b"',
+            '# A comment',
+            '',
+            '--main-arg 3 c',
+            'c --value=raise',
+            'c --bad-arg',
+            'c "unclosed',
+            'c',
+        ]
+        results = turn_system_exit_into_error(
+            batch.run_batch, self.parser, lines)
+        assert results == [
+            (1, 0, (1, (1, False, 'a b'))),
+            (4, 0, (3, (3, True, 'v'))),
+            (5, 1, None),
+            (6, 2, None),
+            (7, 2, None),
+            (8, 0, (1, (1, True, 'v'))),
+        ]
+
+    def test_2_run_batch_jobs(self):
+        lines = ['--main-arg {0} c --value {1}'.format(i, 'raise' if i == 3
+                                                       else i)
+                 for i in range(8)]
+        serial = turn_system_exit_into_error(
+            batch.run_batch, self.parser, lines)
+        parallel = turn_system_exit_into_error(
+            batch.run_batch, self.parser, lines, jobs=3)
+        assert parallel == serial
+        assert [status for _, status, _ in parallel] == [0, 0, 0, 1, 0, 0,
+                                                        0, 0]
+
+
+class TestDaemon(BaseUnitTest):
+    def setUp(self):
+        super(TestDaemon, self).setUp()
+
+        @cmdify.main_command
+        def m(main_arg=1):
+            return main_arg
+
+        @cmdify.command
+        def c(value):
+            print('{0} in {1}: {2}'.format(value, os.getcwd(),
+                                           os.environ.get('DAEMON_TEST')))
+            return value
+
+        @cmdify.command
+        def fail():
+            sys.exit(3)
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp_dir, 'test.sock')
+        parser = cmdify.CommandifyArgumentParser(prog='tool')
+        parser.setup_arguments()
+        self.server_pid = os.fork()
+        if self.server_pid == 0:
+            try:
+                daemon.serve(parser, self.socket_path)
+            finally:
+                os._exit(0)
+        while not os.path.exists(self.socket_path):
+            time.sleep(0.01)
+
+    def tearDown(self):
+        os.kill(self.server_pid, signal.SIGTERM)
+        os.waitpid(self.server_pid, 0)
+        assert not os.path.exists(self.socket_path)
+        shutil.rmtree(self.tmp_dir)
+
+    def _run_client(self, *args):
+        client = os.path.join(os.path.dirname(cmdify.__file__),
+                              'commandify_client')
+        env = dict(os.environ, DAEMON_TEST='env passed')
+        process = subprocess.Popen(
+            [sys.executable, client, self.socket_path] + list(args),
+            cwd=self.tmp_dir, env=env, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        return process.returncode, stdout.decode(), stderr.decode()
+
+    def test_1_client(self):
+        status, stdout, _ = self._run_client('c', '--value', 'a b')
+        assert status == 0
+        assert stdout == 'a b in {0}: env passed\n'.format(
+            os.path.realpath(self.tmp_dir))
+
+    def test_2_exit_status(self):
+        status, _, stderr = self._run_client('c')
+        assert status == 2
+        assert 'the following arguments are required: --value' in stderr
+        assert self._run_client('fail')[0] == 3
+
+    def test_3_socket_permissions(self):
+        # Once a client has been served, the socket's mode has been set.
+        assert self._run_client('c', '--value', 'a')[0] == 0
+        assert stat.S_IMODE(os.stat(self.socket_path).st_mode) == 0o600
+
+
+class TestAsyncCommands(BaseUnitTest):
+    def test_1_async_main_and_command(self):
+        events = []
+
+        @cmdify.main_command
+        async def m(main_arg=1):
+            await asyncio.sleep(0)
+            events.append('main')
+            return main_arg
+
+        @cmdify.command
+        async def c(args, value='v'):
+            events.append('command')
+            await asyncio.sleep(0)
+            return args.main_ret, value
+
+        @cmdify.command
+        def sync_c(args):
+            return args.main_ret
+
+        self._run_dispatch_tests(
+            [], [('--main-arg 2 c', NS(main_arg=2, command='c', value='v'),
+                  (2, (2, 'v'))),
+                 ('sync_c', NS(main_arg=1, command='sync_c'), (1, 1))])
+        assert events == ['main', 'command', 'main']
+
+    def test_2_loop_factory(self):
+        loops = []
+
+        def loop_factory():
+            loops.append(asyncio.new_event_loop())
+            return loops[-1]
+
+        @cmdify.main_command
+        async def m():
+            return asyncio.get_event_loop()
+
+        self.parser = ErrorRaisingArgumentParser(loop_factory=loop_factory)
+        self.parser.setup_arguments()
+        self.parser.parse_args([])
+        assert self.parser.dispatch_commands() == (loops[0], None)
+
+    def test_3_batch_concurrency(self):
+        running = []
+        max_running = []
+
+        @cmdify.main_command
+        def m():
+            return None
+
+        @cmdify.command
+        async def c(value):
+            running.append(value)
+            max_running.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(value)
+            return value
+
+        self.parser.setup_arguments()
+        lines = ['c --value {0}'.format(i) for i in range(10)] + ['c']
+        results = turn_system_exit_into_error(
+            batch.run_batch, self.parser, lines, concurrency=4)
+        assert max(max_running) == 4
+        assert [ret for _, _, ret in results] ==\
+            [(None, str(i)) for i in range(10)] + [None]
+        assert results[-1][:2] == (11, 2)
+
+
+class TestTimings(BaseUnitTest):
+    def setUp(self):
+        super(TestTimings, self).setUp()
+
+        @cmdify.main_command
+        def m(main_arg=1):
+            return main_arg
+
+        @cmdify.command
+        def c(flag=True):
+            return flag
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.old_argv = sys.argv
+
+    def tearDown(self):
+        sys.argv = self.old_argv
+        shutil.rmtree(self.tmp_dir)
+
+    def test_1_json(self):
+        path = os.path.join(self.tmp_dir, 'timings.json')
+        sys.argv = ['tool', '--commandify-timings={0}'.format(path),
+                    'c', '--not-flag']
+        assert cmdify.commandify(exit=False) == (1, False)
+        with open(path) as f:
+            records = json.load(f)
+        assert [(r['phase'], r['command'], r['depth']) for r in records] == [
+            ('import', None, 0),
+            ('setup_arguments', None, 0),
+            ('command_spec', 'm', 1),
+            ('command_spec', 'c', 1),
+            ('add_arguments', 'm', 1),
+            ('build_subparser', 'c', 1),
+            ('parse_args', None, 0),
+            ('replace_bool_args', None, 1),
+            ('get_command_args', 'm', 0),
+            ('get_command_args', 'c', 0),
+            ('main_command', 'm', 0),
+            ('command', 'c', 0),
+        ]
+        assert all(r['seconds'] >= 0 for r in records)
+
+    def test_2_table(self):
+        sys.argv = ['tool', '--commandify-timings', 'c']
+        old_stderr = sys.stderr
+        sys.stderr = StdIOBuffer()
+        try:
+            cmdify.commandify(exit=False)
+            lines = sys.stderr.getvalue().splitlines()
+        finally:
+            sys.stderr = old_stderr
+        assert lines[0].split() == ['phase', 'command', 'ms']
+        assert lines[-1].split()[:2] == ['command', 'c']
+        assert any(line.startswith('  command_spec') for line in lines)
+
+
+def busy_loop(seconds):
+    start = time.process_time()
+    while time.process_time() - start < seconds:
+        pass
+
+
+class TestProfiling(BaseUnitTest):
+    def setUp(self):
+        super(TestProfiling, self).setUp()
+
+        @cmdify.main_command
+        def m():
+            return 'main'
+
+        @cmdify.command
+        def c():
+            busy_loop(0.1)
+            return 'command'
+
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _dispatch(self, profiler):
+        self.parser = ErrorRaisingArgumentParser(
+            prog='tool', profile_dir=self.tmp_dir, profiler=profiler)
+        self.parser.setup_arguments()
+        self.parser.parse_args(['c'])
+        return self.parser.dispatch_commands()
+
+    def test_1_sample(self):
+        assert self._dispatch('sample') == ('main', 'command')
+        assert sorted(os.listdir(self.tmp_dir)) ==\
+            ['tool.c.collapsed', 'tool.m.collapsed']
+        with open(os.path.join(self.tmp_dir, 'tool.c.collapsed')) as f:
+            lines = f.read().splitlines()
+        assert lines
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            assert stack.startswith('{0}:c;{0}:busy_loop'.format(__name__))
+            assert int(count) > 0
+
+    def test_2_cprofile(self):
+        import pstats
+        assert self._dispatch('cprofile') == ('main', 'command')
+        stats = pstats.Stats(os.path.join(self.tmp_dir, 'tool.c.pstats'))
+        assert any(func_name == 'busy_loop'
+                   for _, _, func_name in stats.stats)
+
+
+class TestCommandPlans(BaseUnitTest):
+    def test_1_plan_made_on_decoration(self):
+        @cmdify.main_command
+        def m(args, provided, some_arg, other_arg=True):
+            return args.command, provided, some_arg, other_arg
+
+        module = sys.modules['commandify.commandify']
+        plan = module._command_plans[cmdify._main_commands['m'][0]]
+        assert plan.argument_names ==\
+            ('args', 'provided', 'some_arg', 'other_arg')
+        assert plan.option_names ==\
+            ('--args', '--provided', '--some-arg', '--other-arg')
+        assert plan.defaults == (module._NoDefaultClass,) * 3 + (True,)
+
+    def test_2_bound_once_per_parser(self):
+        @cmdify.main_command
+        def m(args, provided, some_arg, other_arg=True):
+            return args.command, provided, some_arg, other_arg
+
+        @cmdify.command
+        def c():
+            return None
+
+        self.parser = ErrorRaisingArgumentParser(
+            provide_args={'provided': 'p'})
+        self.parser.setup_arguments()
+        for argv, ret in [('--some-arg 1 c', ('c', 'p', '1', True)),
+                          ('--some-arg 2 --not-other-arg c',
+                           ('c', 'p', '2', False))]:
+            self.parser.parse_args(argv.split())
+            assert self.parser.dispatch_commands() == (ret, None)
+        assert len(self.parser._bindings) == 2
+
+
+class TestCommandRegistry(BaseUnitTest):
+    def setUp(self):
+        super(TestCommandRegistry, self).setUp()
+        self.registry = cmdify.CommandRegistry()
+
+        @self.registry.main_command(main_arg={'flag': '-m'})
+        def m(main_arg=1):
+            return main_arg
+
+        @self.registry.command(value={'default': 'v', 'flag': '-v'})
+        def c(value, flag=True):
+            return value, flag
+
+    def test_1_separate_from_default_registry(self):
+        assert not cmdify._main_commands and not cmdify._commands
+        parser = self.registry.parser(prog='tool')
+        assert parser.parse_and_dispatch(['c']) == (1, ('v', True))
+
+    def test_2_registered_options_not_consumed(self):
+        registered = repr(list(self.registry.commands.values()))
+        for _ in range(2):
+            parser = self.registry.parser(prog='tool')
+            assert parser.parse_and_dispatch(['-m', '2', 'c', '-v', 'w']) ==\
+                (2, ('w', True))
+        assert repr(list(self.registry.commands.values())) == registered
+
+    def test_3_repeated_parse_and_dispatch(self):
+        parser = self.registry.parser(prog='tool', lazy=True)
+        for i in range(100):
+            argv = ['-m', str(i), 'c'] + (['--not-flag'] if i % 2 else [])
+            assert parser.parse_and_dispatch(argv) == (i, ('v', i % 2 == 0))
+        assert parser.replaced_bool_args == ['flag']
+
+
+class TestFastParse(BaseUnitTest):
+    def setUp(self):
+        super(TestFastParse, self).setUp()
+
+        @cmdify.main_command(main_arg={'flag': '-m'})
+        def m(main_arg=9, verbose=False):
+            return main_arg
+
+        @cmdify.command(number={'type': int, 'default': '3'})
+        def c1(name, number, ratio=0.5, other_arg=True):
+            return name, number, ratio, other_arg
+
+        @cmdify.command(choice={'choices': ['a', 'b']})
+        def c2(args, choice='a'):
+            return choice
+
+    def _parse(self, argv, fast_parse, lazy=False):
+        parser = ErrorRaisingArgumentParser(
+            fast_parse=fast_parse, lazy=lazy,
+            suppress_warnings=['default_true'])
+        parser.setup_arguments()
+        try:
+            return vars(parser.parse_args(argv.split())), parser
+        except ArgumentParserError as e:
+            return str(e), parser
+
+    def test_1_same_as_argparse(self):
+        argvs = ['c1 --name x', '-m 3 --verbose c1 --name=y --number 7',
+                 '--main-arg=4 c1 --name z --ratio 2 --not-other-arg',
+                 'c1 --name -x', 'c1 --nam x', 'c1', 'c1 --number x',
+                 '-m4 c1 --name x', '--verbose=1 c1', 'c1 --name x --verbose',
+                 'c2 --choice b', 'c2 --choice c', 'c3', '', '-h', 'c1 -h',
+                 'c1 --name x extra', '--main-arg c1']
+        for argv in argvs:
+            assert self._parse(argv, True)[0] ==\
+                self._parse(argv, False)[0], argv
+
+    def test_2_simple_command_lines_skip_argparse(self):
+        ns, parser = self._parse('-m 3 c1 --name y --not-other-arg', True,
+                                 lazy=True)
+        assert ns == {'main_arg': 3, 'verbose': False, 'command': 'c1',
+                      'name': 'y', 'number': 3, 'ratio': 0.5,
+                      'other_arg': False}
+        assert not parser._built_commands
+        assert parser._fast_options['c1'] is not None
+
+        ns, parser = self._parse('c2 --choice b', True, lazy=True)
+        assert ns['choice'] == 'b'
+        assert parser._built_commands == set(['c2'])
+        assert parser._fast_options['c2'] is None
+
+
+class TestHelpCache(BaseUnitTest):
+    def setUp(self):
+        super(TestHelpCache, self).setUp()
+
+        @cmdify.main_command
+        def m(main_arg=9):
+            return main_arg
+
+        @cmdify.command
+        def c1(some_arg='jo'):
+            '''Command one
+            More details'''
+            return some_arg
+
+        @cmdify.command
+        def c2():
+            return None
+
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _help(self, argv, lazy=True, fail_on_render=False):
+        parser = ErrorRaisingArgumentParser(
+            prog='tool', lazy=lazy, cache_dir=self.cache_dir)
+        parser.setup_arguments()
+        if fail_on_render:
+            def fail(*args):
+                raise AssertionError('help not loaded from cache')
+            parser._command_help = fail
+            parser._build_all_subparsers = fail
+        try:
+            parser.parse_args(argv)
+        except ArgumentParserError as e:
+            return e.stdout
+
+    def test_1_warm_help_from_cache(self):
+        for argv in [['--help'], ['c1', '--help']]:
+            cold = self._help(argv)
+            assert cold == self._help(argv, fail_on_render=True)
+            assert cold == self._help(argv, lazy=False)
+        assert 'Command one\n' in self._help(['-h'])
+
+    def test_2_docstrings_read_when_help_rendered(self):
+        parser = ErrorRaisingArgumentParser(prog='tool')
+        parser.setup_arguments()
+        assert [action.help for action in
+                parser._subparsers._choices_actions] == [None, None]
+        assert 'Command one' in parser.format_help()
+
+
+GROUP_MODULE_SOURCE = """
+import commandify as cmdify
+
+remote = cmdify.CommandRegistry()
+
+
+@remote.command
+def push(force=False):
+    return 'push', force
+"""
+
+
+class TestCommandGroups(BaseUnitTest):
+    def setUp(self):
+        super(TestCommandGroups, self).setUp()
+        self.module_dir = tempfile.mkdtemp()
+        sys.path.insert(0, self.module_dir)
+        sys.modules.pop('group_mod', None)
+        with open(os.path.join(self.module_dir, 'group_mod.py'), 'w') as f:
+            f.write(GROUP_MODULE_SOURCE)
+
+    def tearDown(self):
+        sys.path.remove(self.module_dir)
+        shutil.rmtree(self.module_dir)
+
+    def _parser(self, lazy=False):
+        self.registry = cmdify.CommandRegistry()
+
+        @self.registry.main_command
+        def m(main_arg=1):
+            return main_arg
+
+        @self.registry.command
+        def status():
+            return 'status'
+
+        data = self.registry.group('data', help='Manage data')
+
+        @data.command
+        def load(args, path, check=True):
+            return 'load', path, check, args.command, args.data_command
+
+        data.group('remote', 'group_mod:remote', help='Remote data')
+
+        parser = ErrorRaisingArgumentParser(
+            prog='tool', registry=self.registry, lazy=lazy,
+            suppress_warnings=['default_true'])
+        parser.setup_arguments()
+        return parser
+
+    def test_1_dispatch(self):
+        for lazy in [False, True]:
+            parser = self._parser(lazy)
+            assert parser.parse_and_dispatch(['status']) == (1, 'status')
+            assert parser.parse_and_dispatch(
+                ['--main-arg', '2', 'data', 'load', '--path', 'p',
+                 '--not-check']) == (2, ('load', 'p', False, 'data', 'load'))
+            assert parser.parse_and_dispatch(
+                ['data', 'remote', 'push', '--force']) ==\
+                (1, ('push', True))
+            assert vars(parser.args)['data_remote_command'] == 'push'
+            parser.parse_args(['data'])
+            self.assertRaises(ArgumentParserError, turn_system_exit_into_error,
+                              parser.dispatch_commands)
+
+    def test_2_groups_loaded_when_used(self):
+        for lazy in [False, True]:
+            sys.modules.pop('group_mod', None)
+            parser = self._parser(lazy)
+            parser.parse_and_dispatch(['status'])
+            help = turn_system_exit_into_error(parser.format_help)
+            assert 'Manage data\n' in help
+            self.assertRaises(ArgumentParserError, parser.parse_args,
+                              ['data', '--help'])
+            assert 'group_mod' not in sys.modules
+            parser.parse_and_dispatch(['data', 'remote', 'push'])
+            assert 'group_mod' in sys.modules
+
+
+class TestResultCache(BaseUnitTest):
+    def setUp(self):
+        super(TestResultCache, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.calls = []
+
+        @cmdify.main_command
+        def m():
+            return None
+
+        @cmdify.command(cache=True, month={'flag': '-m'})
+        def report(month, scale=2):
+            self.calls.append(month)
+            return [month] * scale
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _parser(self):
+        parser = ErrorRaisingArgumentParser(prog='tool',
+                                            cache_dir=self.cache_dir)
+        parser.setup_arguments()
+        return parser
+
+    def test_1_results_cached(self):
+        parser = self._parser()
+        for argv in [['report', '-m', 'jan'], ['report', '-m', 'feb'],
+                     ['report', '-m', 'jan']]:
+            parser.parse_and_dispatch(argv)
+        # A new parser, as in a new process.
+        assert self._parser().parse_and_dispatch(
+            ['report', '-m', 'feb']) == (None, ['feb', 'feb'])
+        assert self.calls == ['jan', 'feb']
+        # Including the new parser's hit.
+        assert parser.result_cache.stats() == {
+            'hits': 2, 'misses': 2, 'evictions': 0, 'entries': 2,
+            'bytes': parser.result_cache.stats()['bytes']}
+
+    def test_2_eviction(self):
+        from commandify.memo import ResultCache
+        result_cache = ResultCache(self.cache_dir, max_entries=2)
+
+        def key(month):
+            return result_cache.key(busy_loop, {'month': month})
+        for i, month in enumerate(['jan', 'feb', 'mar']):
+            result_cache.put(key(month), month)
+            # Set the last use and store times, as file times may be coarse.
+            os.utime(result_cache._path(key(month)), (1000 + i, 1000 + i))
+        assert result_cache.stats()['entries'] == 2
+        assert result_cache.get(key('jan')) == (False, None)
+        assert result_cache.get(key('feb')) == (True, 'feb')
+        assert result_cache.evictions == 1
+
+        result_cache.ttl = 60
+        assert result_cache.get(key('mar')) == (False, None)
+        assert result_cache.evictions == 2
+
+    def test_3_stats_kept_on_disk(self):
+        from commandify.memo import ResultCache
+        first = ResultCache(self.cache_dir)
+        key = first.key(busy_loop, {'month': 'jan'})
+        assert first.get(key) == (False, None)
+        first.put(key, 'jan')
+        assert first.get(key) == (True, 'jan')
+        second = ResultCache(self.cache_dir)
+        assert second.get(key) == (True, 'jan')
+        assert (second.hits, second.misses) == (1, 0)
+        stats = ResultCache(self.cache_dir).stats()
+        assert (stats['hits'], stats['misses'], stats['entries']) == (2, 1, 1)
+
+    def test_4_cache_dir_needed(self):
+        parser = ErrorRaisingArgumentParser(prog='tool')
+        parser.setup_arguments()
+        parser.parse_args(['report', '--month', 'jan'])
+        self.assertRaises(ArgumentParserError, turn_system_exit_into_error,
+                          parser.dispatch_commands)
+        assert self.calls == []
+
+
+class TestIncrementalCommands(BaseUnitTest):
+    def setUp(self):
+        super(TestIncrementalCommands, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.cache_dir, 'source.txt')
+        self.report = os.path.join(self.cache_dir, 'report.txt')
+        with open(self.source, 'w') as f:
+            f.write('data')
+        self.calls = []
+
+        @cmdify.main_command
+        def m():
+            return None
+
+        @cmdify.command(source={'input': True}, report={'output': True})
+        def summarise(source, report, scale=1):
+            self.calls.append(scale)
+            with open(report, 'w') as f:
+                f.write(open(source).read() * scale)
+            return scale
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _run(self, *extra_args):
+        parser = ErrorRaisingArgumentParser(prog='tool',
+                                            cache_dir=self.cache_dir)
+        parser.setup_arguments()
+        return parser.parse_and_dispatch(
+            ['summarise', '--source', self.source, '--report', self.report] +
+            list(extra_args))[1]
+
+    def test_1_skipped_when_up_to_date(self):
+        assert self._run() == 1
+        assert self._run() is None
+        assert self._run('--scale', '2') == 2
+        assert self._run('--force', '--scale', '2') == 2
+        # Touched, but not changed.
+        os.utime(self.source, (1000, 1000))
+        assert self._run() is None
+        with open(self.source, 'w') as f:
+            f.write('new data')
+        assert self._run() == 1
+        os.remove(self.report)
+        assert self._run() == 1
+        assert self.calls == [1, 2, 2, 1, 1]
+
+    def test_2_dry_run(self):
+        sys.stdout = StdIOBuffer()
+        try:
+            self._run('--dry-run')
+            self._run()
+            self._run('--dry-run')
+            os.remove(self.report)
+            self._run('--dry-run')
+            report = sys.stdout.getvalue()
+        finally:
+            sys.stdout = sys.__stdout__
+        assert report == ('summarise: would run, not run before\n'
+                          'summarise: up to date\n'
+                          'summarise: would run, output {0} missing\n'
+                          .format(self.report))
+        assert self.calls == [1]
+
+
+class TestFileTypes(BaseUnitTest):
+    def setUp(self):
+        super(TestFileTypes, self).setUp()
+        self.data_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.data_dir, 'data.bin')
+        with open(self.path, 'wb') as f:
+            f.write(b'0123456789')
+
+        @cmdify.main_command
+        def m():
+            return None
+
+        @cmdify.command(stream={'type': filetypes.LazyFile})
+        def head(data: memoryview, stream=None):
+            return bytes(data[:3]), stream.read(2) if stream else None
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_1_mapped_and_lazy_files(self):
+        self.parser.setup_arguments()
+        assert self.parser.parse_and_dispatch(
+            ['head', '--data', self.path, '--stream', self.path]) ==\
+            (None, (b'012', b'01'))
+        assert isinstance(self.parser.args.data, memoryview)
+        assert self.parser.args.data.readonly
+        self.assertRaises(ArgumentParserError, self.parser.parse_args,
+                          ['head', '--data', self.path + '.missing'])
+
+    def test_2_memmap(self):
+        array = filetypes.MemmapType()(self.path)
+        assert bytes(array[-2:]) == b'89'
+        assert filetypes.annotation_type('numpy.memmap').dtype == 'uint8'
+
+
+class TestMapReduce(BaseUnitTest):
+    def setUp(self):
+        super(TestMapReduce, self).setUp()
+        self.data_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.data_dir, 'log.txt')
+        with open(self.path, 'w') as f:
+            for i in range(1000):
+                f.write('{0} {1}\n'.format('ERROR' if i % 7 == 0 else 'INFO',
+                                           i))
+
+        @cmdify.main_command
+        def m():
+            return None
+
+        @cmdify.command(map_reduce=mapreduce.MapReduce(
+            'path', reduce=lambda a, b: a + b, jobs=2, chunk_size=1000))
+        def count(path, pattern='ERROR'):
+            return [sum(1 for line in path if pattern.encode() in line)]
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_1_dispatch(self):
+        self.parser.setup_arguments()
+        _, counts = self.parser.parse_and_dispatch(['count', '--path',
+                                                    self.path])
+        assert len(counts) == len(mapreduce.chunk_ranges(self.path, 1000))
+        assert sum(counts) == 143
+        assert self.parser.parse_and_dispatch(
+            ['count', '--path', self.path, '--pattern', 'INFO 998'])[1] ==\
+            [0] * (len(counts) - 1) + [1]
+
+    def test_2_chunks_end_on_records(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'a;;bb;;;;ccc;;d')
+        ranges = mapreduce.chunk_ranges(self.path, 3, b';;')
+        assert ranges == [(0, 3), (3, 7), (7, 14), (14, 15)]
+        assert [list(mapreduce.Chunk(self.path, start, end, b';;'))
+                for start, end in ranges] ==\
+            [[b'a;;'], [b'bb;;'], [b';;', b'ccc;;'], [b'd']]
+
+
+class TestCommandChaining(BaseUnitTest):
+    def setUp(self):
+        super(TestCommandChaining, self).setUp()
+        self.parser = ErrorRaisingArgumentParser(chain=True)
+        self.consumed = []
+
+        @cmdify.main_command
+        def m(main_arg=1):
+            return main_arg
+
+        @cmdify.command
+        def numbers(count=3):
+            for i in range(count):
+                self.consumed.append(i)
+                yield i
+
+        @cmdify.command
+        def scale(args, by=2):
+            for i in args.prev_ret:
+                yield i * by * args.main_ret
+
+        @cmdify.command
+        def total(args, op='+'):
+            assert self.consumed == []
+            return op, sum(args.prev_ret)
+
+    def test_1_chained_dispatch(self):
+        for fast_parse in [False, True]:
+            self.consumed = []
+            parser = ErrorRaisingArgumentParser(fast_parse=fast_parse,
+                                                chain=True)
+            parser.setup_arguments()
+            assert parser.parse_and_dispatch(
+                ['--main-arg', '10', 'numbers', '--count', '4', '+', 'scale',
+                 '--by', '3', '+', 'total', '--op=+']) == (10, ('+', 180))
+            assert parser.args.command == 'numbers'
+            assert [args.command for args in parser.chained_args] ==\
+                ['scale', 'total']
+            # Generators were consumed by total.
+            assert self.consumed == [0, 1, 2, 3]
+            parser.parse_args(['numbers'])
+            assert parser.chained_args == []
+
+    def test_2_errors(self):
+        self.parser.setup_arguments()
+        for argv in [['numbers', '+'], ['numbers', '+', '--by', '2'],
+                     ['numbers', '+', 'scale', '--count', '2']]:
+            self.assertRaises(ArgumentParserError, self.parser.parse_args,
+                              argv)
+
+    def test_3_batch_concurrency(self):
+        self.parser.setup_arguments()
+        results = batch.run_batch(
+            self.parser, ['numbers --count 2 + scale',
+                          '--main-arg 2 numbers + scale --by 3'],
+            concurrency=2)
+        assert [(status, main_ret, list(command_ret))
+                for _, status, (main_ret, command_ret) in results] ==\
+            [(0, 1, [0, 2]), (0, 2, [0, 6, 12])]
+
+    def test_4_required_main_argument(self):
+        cmdify._main_commands.clear()
+
+        @cmdify.main_command
+        def m(main_arg, verbose=False):
+            return main_arg, verbose
+
+        for lazy in [False, True]:
+            self.consumed = []
+            parser = ErrorRaisingArgumentParser(chain=True, lazy=lazy)
+            parser.setup_arguments()
+            assert parser.parse_and_dispatch(
+                ['--main-arg', '2', '--verbose', 'numbers', '+', 'total']) ==\
+                (('2', True), ('+', 3))
+            assert parser.chained_args[0] == NS(
+                main_arg='2', verbose=True, command='total', op='+',
+                main_ret=('2', True), prev_ret=parser.chained_args[0].prev_ret)
+            # Main command arguments are only given before the first.
+            self.assertRaises(ArgumentParserError, parser.parse_args,
+                              ['--main-arg', '2', 'numbers', '+', 'total',
+                               '--main-arg', '3'])
+
+    def test_5_plus_argument_value(self):
+        @cmdify.command
+        def calc(op):
+            return op
+
+        for chain in [False, True]:
+            parser = ErrorRaisingArgumentParser(chain=chain)
+            parser.setup_arguments()
+            assert parser.parse_and_dispatch(['calc', '--op', '+']) ==\
+                (1, '+')
+        # Followed by a command name, + chains, so --op needs --op=+.
+        self.assertRaises(ArgumentParserError, parser.parse_args,
+                          ['calc', '--op', '+', 'total'])
+        parser = ErrorRaisingArgumentParser()
+        parser.setup_arguments()
+        self.assertRaises(ArgumentParserError, parser.parse_args,
+                          ['numbers', '+', 'total'])
+
+
+class TestRequiredCommands(BaseUnitTest):
+    def setUp(self):
+        super(TestRequiredCommands, self).setUp()
+        self.parser = ErrorRaisingArgumentParser(chain=True)
+        self.runs = []
+
+        @cmdify.main_command
+        def m(main_arg=1):
+            return main_arg
+
+        @cmdify.command
+        def fetch(args, url='u'):
+            self.runs.append('fetch')
+            return url * args.main_ret
+
+        @cmdify.command(requires=['fetch'])
+        def index(args):
+            self.runs.append('index')
+            return args.required_ret['fetch'] + 'i'
+
+        @cmdify.command(requires=['fetch'])
+        def stats(args):
+            return len(args.required_ret['fetch'])
+
+        @cmdify.command(requires=['index', 'stats', 'fetch'])
+        def report(args, month='jan'):
+            return month, sorted(args.required_ret.items())
+
+        @cmdify.command(requires=['loop_b'])
+        def loop_a():
+            return None
+
+        @cmdify.command(requires=['loop_a'])
+        def loop_b():
+            return None
+
+    def test_1_dispatch(self):
+        for dag_executor in ['thread', 'process']:
+            self.runs = []
+            parser = ErrorRaisingArgumentParser(dag_executor=dag_executor,
+                                                dag_jobs=2, chain=True)
+            parser.setup_arguments()
+            assert parser.parse_and_dispatch(
+                ['--main-arg', '2', 'report', '--month', 'feb']) ==\
+                (2, ('feb', [('fetch', 'uu'), ('index', 'uui'),
+                             ('stats', 2)]))
+            # Each required command is run once, also when chained.
+            assert parser.parse_and_dispatch(
+                ['index', '+', 'report'])[1][1][1] == ('index', 'ui')
+            if dag_executor == 'thread':
+                assert self.runs == ['fetch', 'index', 'fetch', 'index']
+
+    def test_2_cycle(self):
+        self.parser.setup_arguments()
+        self.parser.parse_args(['loop_a'])
+        self.assertRaises(ArgumentParserError, turn_system_exit_into_error,
+                          self.parser.dispatch_commands)
+
+    def test_3_required_command_chained_after(self):
+        self.parser.setup_arguments()
+        self.parser.parse_args(['index', '+', 'fetch'])
+        self.assertRaises(ArgumentParserError, turn_system_exit_into_error,
+                          self.parser.dispatch_commands)
+        assert self.runs == ['fetch', 'index']
+        # Chained first, so run once.
+        self.runs = []
+        assert self.parser.parse_and_dispatch(
+            ['fetch', '--url', 'v', '+', 'index']) == (1, 'vi')
+        assert self.runs == ['fetch', 'index']
+
+    def test_4_required_main_argument(self):
+        cmdify._main_commands.clear()
+
+        @cmdify.main_command(main_arg={'type': int})
+        def m(main_arg):
+            return main_arg
+
+        self.parser.setup_arguments()
+        assert self.parser.parse_and_dispatch(
+            ['--main-arg', '2', 'index']) == (2, 'uui')
+
+    def test_5_batch_concurrency(self):
+        self.parser.setup_arguments()
+        results = batch.run_batch(
+            self.parser, ['--main-arg 2 index', 'stats', 'fetch'],
+            concurrency=2)
+        assert results == [(1, 0, (2, 'uui')), (2, 0, (1, 1)),
+                           (3, 0, (1, 'u'))]